@@ -0,0 +1,84 @@
+"""
+Compares the legacy per-sentence scoring loop from score_sentences against the batched
+SentenceScorer, scoring synthetic sentences against a synthetic vocabulary.
+
+Run from the repository root:
+    python benchmarks/scoring_benchmark.py [n_sentences] [n_vocab]
+"""
+import os
+import random
+import string
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from utils.sentence_scoring import SentenceScorer
+from utils.tokenizers import get_tokenizer
+
+LANGUAGE = 'French'
+COLUMNS = ['n_words', 'n_known_words', 'n_new_words', 'n_rogue_words']
+
+def make_vocab(n_words, rng):
+    words = set()
+    while len(words) < n_words:
+        words.add(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))))
+    return list(words)
+
+def make_synthetic_sentences(n_sentences, known, new, rng):
+    sentences = []
+    for _ in range(n_sentences):
+        words = rng.choices(known, k=rng.randint(5, 15)) + [rng.choice(new)]
+        if rng.random() < 0.3:
+            words.append('xyz' + rng.choice(known))
+        rng.shuffle(words)
+        # Punctuation attached to words, as the model writes them
+        words[0] = words[0].capitalize()
+        words[-1] = f"<b>{words[-1]}</b>."
+        sentences.append(' '.join(words[:-1]) + ', ' + words[-1])
+    return sentences
+
+def legacy_score(sentences, known_vocab, new_vocab):
+    known_vocab_set = set(known_vocab.dropna())
+    new_vocab_set = set(new_vocab.dropna())
+    tokenizer = get_tokenizer(LANGUAGE)
+
+    def count_word_types(sentence):
+        tokens = tokenizer.tokenize(sentence)
+        sentence_words = set(tokens)
+        n_known_words = len(sentence_words.intersection(known_vocab_set))
+        n_new_words = len(sentence_words.intersection(new_vocab_set))
+        return pd.Series([len(tokens), n_known_words, n_new_words, len(sentence_words) - n_known_words - n_new_words])
+
+    scores = pd.Series(sentences).apply(count_word_types)
+    scores.columns = COLUMNS
+    return scores
+
+def batched_score(sentences, known_vocab, new_vocab):
+    scores = SentenceScorer(known_vocab, new_vocab, LANGUAGE).score(sentences)
+    return pd.DataFrame({column: scores[column] for column in COLUMNS})
+
+def time_it(label, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<8} {elapsed:8.3f}s  {len(result) / elapsed:>12,.0f} sentences/s")
+    return result
+
+if __name__ == "__main__":
+    n_sentences = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_vocab = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+    rng = random.Random(0)
+
+    vocab = make_vocab(n_vocab + 500, rng)
+    known, new = vocab[:n_vocab], vocab[n_vocab:]
+    sentences = make_synthetic_sentences(n_sentences, known, new, rng)
+    known_vocab, new_vocab = pd.Series(known, dtype=str), pd.Series(new, dtype=str)
+    print(f"Scoring {n_sentences:,} synthetic {LANGUAGE} sentences against {n_vocab:,} known words")
+
+    legacy = time_it('legacy', legacy_score, sentences, known_vocab, new_vocab)
+    batched = time_it('batched', batched_score, sentences, known_vocab, new_vocab)
+
+    assert np.array_equal(legacy.to_numpy(dtype=np.int64), batched.to_numpy(dtype=np.int64)), "Batched scores differ from the legacy loop"
@@ -0,0 +1,119 @@
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+import numpy as np
+import pandas as pd
+
+class DataFrameTableModel(QAbstractTableModel):
+    """
+    Table model backed directly by a pandas DataFrame, for use with a QTableView.
+    The view only asks for the cells it's painting, so tables of tens of thousands of rows stay cheap.
+    Column 0 is a checkbox column whose states are kept in a boolean array alongside the frame;
+    boolean columns of the frame are shown as read-only checkboxes.
+    """
+    def __init__(self, check_header='Export', parent=None):
+        super().__init__(parent)
+        self.check_header = check_header
+        self.columns = []
+        self.data_frame = pd.DataFrame()
+        self.checked = np.zeros(0, dtype=bool)
+        self._values = []
+
+    def set_columns(self, columns):
+        """Sets the (DataFrame column, header) pairs shown after the checkbox column."""
+        self.beginResetModel()
+        self.columns = list(columns)
+        self._refresh_values()
+        self.endResetModel()
+
+    def set_rows(self, data_frame, checked=False):
+        """Replaces every row. `checked` is the initial checkbox state: a bool, or one bool per row."""
+        self.beginResetModel()
+        self.data_frame = data_frame.reset_index(drop=True)
+        self.checked = self._as_checked(checked, len(self.data_frame))
+        self._refresh_values()
+        self.endResetModel()
+
+    def append_rows(self, data_frame, checked=False):
+        """Adds rows to the end of the table, e.g. as they stream in."""
+        if data_frame.empty:
+            return
+        first = len(self.data_frame)
+        self.beginInsertRows(QModelIndex(), first, first + len(data_frame) - 1)
+        self.data_frame = pd.concat([self.data_frame, data_frame], ignore_index=True)
+        self.checked = np.concatenate([self.checked, self._as_checked(checked, len(data_frame))])
+        self._refresh_values()
+        self.endInsertRows()
+
+    def clear(self):
+        self.set_rows(pd.DataFrame())
+
+    def checked_rows(self):
+        """
+        Returns a copy of the rows whose checkbox is ticked, with every column of the underlying frame.
+        They keep their row numbers in the table as their index, so they can be passed back to set_checked.
+        """
+        return self.data_frame[self.checked].copy()
+
+    def set_checked(self, rows, checked):
+        """Ticks (or unticks) the checkboxes of the given row numbers."""
+        rows = np.asarray(list(rows), dtype=int)
+        if rows.size == 0:
+            return
+        self.checked[rows] = checked
+        self.dataChanged.emit(self.index(rows.min(), 0), self.index(rows.max(), 0), [Qt.CheckStateRole])
+
+    def _as_checked(self, checked, n_rows):
+        if np.isscalar(checked):
+            return np.full(n_rows, bool(checked))
+        return np.asarray(pd.Series(checked).fillna(False), dtype=bool)
+
+    def _refresh_values(self):
+        # One array per shown column, so that data() never goes through pandas indexing
+        self._values = [
+            self.data_frame[column].to_numpy() if column in self.data_frame.columns else np.full(len(self.data_frame), None, dtype=object)
+            for column, _ in self.columns
+        ]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.data_frame)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns) + 1
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = index.row(), index.column()
+
+        if column == 0:
+            if role == Qt.CheckStateRole:
+                return Qt.Checked if self.checked[row] else Qt.Unchecked
+            return None
+
+        value = self._values[column - 1][row]
+        if isinstance(value, (bool, np.bool_)):
+            if role == Qt.CheckStateRole:
+                return Qt.Checked if value else Qt.Unchecked
+            return None
+        if role in (Qt.DisplayRole, Qt.ToolTipRole):
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                return ""
+            return str(value)
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if index.isValid() and index.column() == 0 and role == Qt.CheckStateRole:
+            self.checked[index.row()] = (value == Qt.Checked)
+            self.dataChanged.emit(index, index, [role])
+            return True
+        return False
+
+    def flags(self, index):
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.column() == 0:
+            flags |= Qt.ItemIsUserCheckable
+        return flags
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation != Qt.Horizontal or role != Qt.DisplayRole:
+            return None
+        return self.check_header if section == 0 else self.columns[section - 1][1]
@@ -1,8 +1,8 @@
 from PyQt5.QtWidgets import QComboBox, QWidget, QFrame, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QTreeWidget, QTreeWidgetItem, QMessageBox
 import pandas as pd
 from utils.anki_connect_functions import *
-from iplusone import IPlusOneFrameQt
-from previous_cards_audio_frame import PreviousCardsAudioFrameQt
+from utils.token_cache import field_signature, load_cached_tokens, sync_cached_tokens
+from utils.sentence_scoring import SentenceScorer
 
 class DecksHomepageQt(QWidget):
     def __init__(self, parent=None):
@@ -20,6 +20,7 @@ class DecksHomepageQt(QWidget):
         configuration_data = fetch_user_configuration(self, self.controller.selected_user_id, self.controller.configuration_name)
         
         if configuration_data:
+            self.controller.configuration_id = configuration_data['configuration_id']
             self.controller.learned_deck = configuration_data['learned_deck']
             self.controller.new_deck = configuration_data['new_deck']
             self.controller.learned_deck_tokens = self.load_vocab_from_deck('learned_deck', configuration_data)
@@ -31,6 +32,9 @@ class DecksHomepageQt(QWidget):
                 self.controller.new_deck_tokens = self.controller.new_deck_tokens[~self.controller.new_deck_tokens.isin(self.controller.learned_deck_tokens)]
             except ValueError:
                 self.controller.new_deck_tokens = pd.Series(dtype=str)
+
+            # Index the vocab once per deck load, so that scoring generated sentences never rebuilds it
+            self.controller.sentence_scorer = SentenceScorer(self.controller.learned_deck_tokens, self.controller.new_deck_tokens, self.controller.selected_language)
             
             # Update the tables
             self.insert_vocab_into_treeview(self.learned_deck_treeview, self.controller.learned_deck_tokens)
@@ -131,12 +135,14 @@ class DecksHomepageQt(QWidget):
         # Hard-assign the audio file to the final field of the card. This is potentially destructive!!
         
     def generate_iplus1(self):
+        from iplusone import IPlusOneFrameQt
         self.controller.show_frame(IPlusOneFrameQt)
 
     def generate_sentences_for_selected_token(self):
         pass
     
     def generate_audio_for_existing_cards(self):
+        from previous_cards_audio_frame import PreviousCardsAudioFrameQt
         self.controller.show_frame(PreviousCardsAudioFrameQt)
     
     def verb_exploder(self):
@@ -166,10 +172,12 @@ class DecksHomepageQt(QWidget):
         - card_types_and_fields (dict): A dictionary where keys are card types and values are lists of fields.
 
         Returns:
-        - pd.Series: A series of unique vocabulary words.
+        - pd.Series: A series of unique vocabulary words, most frequent first.
+          The token list of every note is also kept in controller.deck_note_tokens[deck].
         """
         
         # Extract deck and card_types_and_fields from raw_config_data
+        deck_key = deck
         deck = raw_config_data.get(deck, None)
         raw_card_types_and_fields = raw_config_data.get('card_types_and_fields', {})
         configuration_language = raw_config_data.get('configuration_language', None)
@@ -182,36 +190,56 @@ class DecksHomepageQt(QWidget):
             card_types_and_fields[card_type] = clean_fields
 
         all_words = []
-
-        for card_type, fields in card_types_and_fields.items():
-            # Construct the query for the card type
-            query = f'"deck:{deck}" "note:{card_type}"'
-
-            # Retrieve note IDs for the card type
-            note_ids = ankiconnect_invoke(self, 'findNotes', query=query)
-            if note_ids == 1:
-               print("YES")
-               return None
-           
-            # Retrieve note content for the card type
-            note_content = pd.json_normalize(ankiconnect_invoke(self, 'notesInfo', notes=note_ids))
-
-            # Remove non-Devanagari text, HTML tags, and Anki Cloze notation for all specified fields
-            for field in fields:
-                col_name = f"fields.{field}.value"
-                if col_name in note_content.columns:
-                    note_content[col_name] = note_content[col_name].astype(str).apply(lambda text: strip_punctuation(text))
-                    note_content[col_name] = note_content[col_name].astype(str).apply(lambda text: strip_html_and_cloze(text))
-                    note_content[col_name] = note_content[col_name].astype(str).apply(lambda text: remove_non_language_tokens(text, configuration_language))
-                    
-            # Extract words from all specified fields
-            for field in fields:
-                col_name = f"fields.{field}.value"
-                if col_name in note_content.columns:
-                    words = (note_content[col_name].str.split(expand=True)
-                             .stack()
-                             .reset_index(level=1, drop=True))
-                    all_words.append(words)
+        note_tokens = []
+
+        # Retrieve the note IDs for every card type in a single batched call
+        queries = [f'"deck:{deck}" "note:{card_type}"' for card_type in card_types_and_fields]
+        note_ids_by_card_type = ankiconnect_multi(self, [request('findNotes', query=query) for query in queries])
+        if note_ids_by_card_type == 1:
+            return None
+
+        # Look up when each note was last modified, and compare against the local token cache
+        all_note_ids = [note_id for note_ids in note_ids_by_card_type for note_id in note_ids]
+        mod_times = fetch_notes_mod_time(self, all_note_ids)
+        if mod_times == 1:
+            return None
+
+        signatures = [field_signature(deck, card_type, fields, configuration_language) for card_type, fields in card_types_and_fields.items()]
+        cached_by_card_type = [load_cached_tokens(signature) for signature in signatures]
+
+        # Only notes that are new or were modified since they were cached need to be downloaded.
+        # If AnkiConnect can't report modification times then every note is treated as stale.
+        stale_note_ids = [
+            note_id
+            for note_ids, cached in zip(note_ids_by_card_type, cached_by_card_type)
+            for note_id in note_ids
+            if mod_times is None or note_id not in cached or cached[note_id][0] != mod_times.get(note_id)
+        ]
+
+        # Retrieve the content of the stale notes in bounded pages
+        stale_notes = fetch_notes_info(self, stale_note_ids)
+        if stale_notes == 1:
+            return None
+        notes_by_id = {note['noteId']: note for note in stale_notes if note}
+
+        for (card_type, fields), note_ids, cached, signature in zip(card_types_and_fields.items(), note_ids_by_card_type, cached_by_card_type, signatures):
+            # Re-tokenize the stale notes for the card type, removing non-language text, HTML tags, and Anki Cloze notation
+            stale_notes = [notes_by_id[note_id] for note_id in note_ids if note_id in notes_by_id]
+            updated = {
+                note_id: ((mod_times or {}).get(note_id, notes_by_id[note_id].get('mod')), tokens)
+                for note_id, tokens in tokenize_notes(stale_notes, fields, configuration_language).items()
+            }
+            removed_note_ids = set(cached) - set(note_ids)
+            if updated or removed_note_ids:
+                sync_cached_tokens(signature, updated, removed_note_ids)
+
+            # Extract words from every note, whether freshly tokenized or cached
+            for note_id in note_ids:
+                if note_id in updated:
+                    note_tokens.append(updated[note_id][1])
+                elif note_id in cached:
+                    note_tokens.append(cached[note_id][1])
+        all_words = [token for tokens in note_tokens for token in tokens]
 
         # Combine all words and remove duplicates
         if not all_words:
@@ -221,6 +249,11 @@ class DecksHomepageQt(QWidget):
                 f"with their fields are correct."
             )
 
-        combined = pd.concat(all_words, ignore_index=True).dropna().drop_duplicates(keep='first')
+        # Keep the per-note tokens around for prompt vocabulary selection
+        self.controller.deck_note_tokens[deck_key] = note_tokens
+
+        # Order by frequency so that the most useful words come first, breaking ties by first appearance
+        counts = pd.Series(all_words, dtype=str).value_counts(sort=False).sort_values(ascending=False, kind='stable')
+        combined = pd.Series(counts.index, dtype=str)
 
         return combined
@@ -1,19 +1,48 @@
-from PyQt5.QtWidgets import QAbstractItemView, QWidget, QFrame, QVBoxLayout, QHBoxLayout, QLabel, QCheckBox, QComboBox, QPushButton, QTreeWidget, QTreeWidgetItem, QScrollBar
-from PyQt5.QtCore import Qt, QPropertyAnimation, QSequentialAnimationGroup, pyqtSignal, pyqtProperty
+from PyQt5.QtWidgets import QAbstractItemView, QWidget, QFrame, QVBoxLayout, QHBoxLayout, QLabel, QCheckBox, QComboBox, QPushButton, QTableView, QHeaderView, QScrollBar, QProgressBar
+from PyQt5.QtWidgets import QMessageBox
+from PyQt5.QtCore import Qt, QPropertyAnimation, QSequentialAnimationGroup, QRunnable, QThreadPool, pyqtSignal, pyqtProperty
 from PyQt5.QtGui import QColor, QPalette
+import threading
 import pandas as pd
-from utils.text_generating_functions import generate_text
-from utils.audio_generating_functions import generate_audio
+from utils.text_generating_functions import generate_text, GenerationCancelled
+from utils.generation_cache import GENERATION_CACHE_ENABLED
+from utils.audio_generating_functions import generate_audio, iter_generated_audio
+from utils.export_pipeline import export_notes
 from utils.anki_connect_functions import create_new_card
+from dataframe_table_model import DataFrameTableModel
 
 class GeneratingFrameQt(QWidget):
     """Superclass for all GUI frames that involve generating sentences or audio"""
     update_ui_signal = pyqtSignal(object)
+    rows_ready_signal = pyqtSignal(object)
+    export_progress_signal = pyqtSignal(object)
+    export_finished_signal = pyqtSignal(object)
+
+    # The results table: the header of its checkbox column, the column that decides whether a row
+    # starts out checked, and the (DataFrame column, header) pairs shown after it. Subclasses override these.
+    check_column_header = 'Export'
+    checked_by_default_column = 'meets_criteria'
+    table_columns = [
+        ('sentence', 'Sentence'), ('translation', 'Translation'), ('new_word', 'New Word'),
+        ('n_words', 'Total Words'), ('n_known_words', 'Known Words'), ('n_new_words', 'New Words'),
+        ('n_rogue_words', 'Rogue Words'), ('meets_criteria', 'Meets Criteria'),
+    ]
     
     def __init__(self, parent=None):
         super().__init__(parent)
         self.controller = parent
         self.initUI()
+
+        # Generation runs on a worker thread, which reports back through update_ui_signal
+        self.thread_pool = QThreadPool.globalInstance()
+        self.cancel_event = None
+        self.streamed_rows = False
+        self.update_ui_signal.connect(self.on_generation_finished)
+        self.rows_ready_signal.connect(self.on_rows_ready)
+        self.export_progress_signal.connect(self.on_export_progress)
+        self.export_finished_signal.connect(self.on_export_finished)
+        self.export_rows = None
+        self.export_table_rows = None
         
     def showEvent(self, event):
         """Override the showEvent"""
@@ -39,6 +68,16 @@ class GeneratingFrameQt(QWidget):
         self.model_picklist.addItems(['sonnet', 'opus', 'haiku'])
         self.model_layout.addWidget(self.model_label)
         self.model_layout.addWidget(self.model_picklist)
+
+        # Only offered when the generation cache has been switched on
+        self.bypass_cache_checkbox = QCheckBox('Bypass generation cache', self)
+        self.bypass_cache_checkbox.setVisible(GENERATION_CACHE_ENABLED)
+        self.model_layout.addWidget(self.bypass_cache_checkbox)
+
+        # Show sentences in the table as they arrive, rather than when the whole batch is done
+        self.stream_checkbox = QCheckBox('Stream results', self)
+        self.stream_checkbox.setChecked(True)
+        self.model_layout.addWidget(self.stream_checkbox)
         self.main_layout.addLayout(self.model_layout)
 
         # Selection Criterion UI
@@ -64,6 +103,12 @@ class GeneratingFrameQt(QWidget):
         self.generate_button = QPushButton("Generate Sentences", self)
         self.generate_button.clicked.connect(self.on_press_generate)
         self.main_layout.addWidget(self.generate_button)
+
+        # Cancel button, only shown while a generation job is in flight
+        self.cancel_button = QPushButton("Cancel", self)
+        self.cancel_button.clicked.connect(self.on_press_cancel)
+        self.cancel_button.hide()
+        self.main_layout.addWidget(self.cancel_button)
         
         # Loading Indicator
         self.loading_label = FadeLabel('Generating Sentences...', self)
@@ -74,6 +119,12 @@ class GeneratingFrameQt(QWidget):
         self.loading_label.hide()
         self.main_layout.addWidget(self.loading_label)
 
+        # Report of how big the last prompt was
+        self.prompt_size_label = QLabel('', self)
+        self.prompt_size_label.setAlignment(Qt.AlignCenter)
+        self.prompt_size_label.hide()
+        self.main_layout.addWidget(self.prompt_size_label)
+
         # Fade-out animation
         fade_out = QPropertyAnimation(self.loading_label, b"opacity")
         fade_out.setDuration(1000)
@@ -92,14 +143,14 @@ class GeneratingFrameQt(QWidget):
         self.animation.addAnimation(fade_in)
         self.animation.setLoopCount(-1)  # Loop indefinitely
 
-        # Scrollable table
-        self.table = QTreeWidget(self)
-        self.table.setColumnCount(9)  
-        self.table.setHeaderLabels([
-            'Export', 'Sentence', 'Translation', 'New Word', 
-            'Total Words', 'Known Words', 'New Words',
-            'Rogue Words', 'Meets Criteria'
-        ])  
+        # Scrollable table, backed directly by the results DataFrame so only visible rows are ever rendered
+        self.table = QTableView(self)
+        self.table_model = DataFrameTableModel(self.check_column_header, self)
+        self.table_model.set_columns(self.table_columns)
+        self.table.setModel(self.table_model)
+        self.table.verticalHeader().hide()
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table.horizontalHeader().setStretchLastSection(True)
         
         # Set selection mode to allow multiple row selection
         self.table.setSelectionMode(QAbstractItemView.ExtendedSelection)
@@ -124,6 +175,11 @@ class GeneratingFrameQt(QWidget):
         self.export_button.clicked.connect(self.export_to_anki)
         self.export_button.hide() 
         self.main_layout.addWidget(self.export_button)
+
+        # Export progress, only shown while an export is running
+        self.export_progress_bar = QProgressBar(self)
+        self.export_progress_bar.hide()
+        self.main_layout.addWidget(self.export_progress_bar)
         
         # Audio-related widgets sub-frame
         self.audio_frame = QFrame(self)
@@ -173,6 +229,90 @@ class GeneratingFrameQt(QWidget):
         """Stub function for inheriting frame classes"""
         pass
 
+    def show_prompt_size(self, prompts, n_prompt_vocab):
+        """Reports the size of the prompt(s) about to be sent, and how much learned vocabulary they carry."""
+        n_chars = sum(len(prompt) for prompt in prompts)
+        self.prompt_size_label.setText(
+            f"Prompt size: {n_chars:,} characters across {len(prompts)} request(s), "
+            f"with {n_prompt_vocab:,} of {len(self.controller.learned_deck_tokens):,} learned words each"
+        )
+        self.prompt_size_label.show()
+
+    def generation_request(self):
+        """
+        Snapshot of everything generate_text needs, read on the UI thread so that
+        the worker thread never has to touch any widgets.
+        """
+        return {
+            'prompt': self.prompt,
+            'model': self.model_picklist.currentText(),
+            'selection_criterion': self.selection_criterion_picklist.currentText(),
+            'scorer': self.controller.sentence_scorer,
+            'use_cache': GENERATION_CACHE_ENABLED,
+            'bypass_cache': self.bypass_cache_checkbox.isChecked(),
+            'audio_provider': self.audio_source_picklist.currentText() if self.audio_checkbox.isChecked() else None,
+            'configuration_id': self.controller.configuration_id,
+        }
+
+    def start_generation(self, job):
+        """
+        Runs `job(cancel_event, on_rows)` on the thread pool. Its return value (or the exception it raised)
+        is delivered to on_generation_finished through update_ui_signal. If streaming is switched on,
+        `on_rows` can be called from the worker with DataFrames of rows to show straight away.
+        """
+        self.cancel_event = threading.Event()
+        self.streamed_rows = False
+
+        self.loading_label.show()
+        self.generate_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.cancel_button.show()
+        self.animation.start()
+
+        on_rows = None
+        if self.stream_checkbox.isChecked():
+            cancel_event = self.cancel_event
+            on_rows = lambda rows: self.rows_ready_signal.emit((cancel_event, rows))
+
+        self.thread_pool.start(GenerationWorker(lambda cancel_event: job(cancel_event, on_rows), self.update_ui_signal, self.cancel_event))
+
+    def on_press_cancel(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.cancel_button.setEnabled(False)
+
+    def on_rows_ready(self, payload):
+        cancel_event, rows = payload
+        if cancel_event is not self.cancel_event:
+            return
+
+        # The first rows of a run replace whatever the table was showing before
+        if not self.streamed_rows:
+            self.prepare_treeview()
+            self.streamed_rows = True
+        self.add_treeview_rows(rows)
+
+    def on_generation_finished(self, payload):
+        cancel_event, result = payload
+
+        # Ignore results from jobs that were cancelled and superseded by a newer one
+        if cancel_event is not self.cancel_event:
+            return
+        self.cancel_event = None
+
+        self.animation.stop()
+        self.loading_label.hide()
+        self.cancel_button.hide()
+        self.generate_button.setEnabled(True)
+
+        if isinstance(result, GenerationCancelled):
+            return
+        if isinstance(result, Exception):
+            QMessageBox.critical(self, "Generation Error", str(result))
+            return
+
+        self.update_ui_after_generation(result, 'meets_criteria')
+
     def update_ui_after_generation(self, sentences, checkbox_column):
 
         if sentences is not None:
@@ -183,11 +323,21 @@ class GeneratingFrameQt(QWidget):
         self.audio_frame.show()
 
     def populate_treeview(self, data_frame):
-        pass
+        self.prepare_treeview()
+        self.add_treeview_rows(data_frame)
+
+    def prepare_treeview(self):
+        """Clears the table and sets its headers from table_columns"""
+        self.table_model.set_columns(self.table_columns)
+        self.table_model.clear()
+
+    def add_treeview_rows(self, data_frame):
+        """Appends rows to the table, checked according to checked_by_default_column"""
+        self.table_model.append_rows(data_frame, data_frame.get(self.checked_by_default_column, False))
 
     def clear_treeview(self):
         """Clear all entries in the treeview."""
-        self.table.clear()
+        self.table_model.clear()
 
     def create_export_buttons(self):
         """Create 'Export to Anki' buttons."""
@@ -209,6 +359,88 @@ class GeneratingFrameQt(QWidget):
     def export_to_anki(self):
         pass
 
+    def start_export(self, export_df, make_note):
+        """
+        Exports `export_df` to Anki on the thread pool, synthesizing audio if the 'with audio' box is
+        checked and adding each note as soon as its audio is ready. Progress and the per-row results come
+        back through export_progress_signal and export_finished_signal.
+
+        Parameters:
+        - export_df (pd.DataFrame): The checked rows, with at least a 'sentence' column.
+        - make_note (callable): Builds the note dict for a row, once its 'audio' is set. It runs on the worker thread.
+        """
+        # Read the widgets here on the UI thread
+        with_audio = self.audio_checkbox.isChecked()
+        language = self.controller.selected_language
+        profile_name = self.controller.selected_profile_name
+        tts_api = self.audio_source_picklist.currentText()
+
+        def job(cancel_event):
+            audio_clips = iter_generated_audio(export_df['sentence'], language, profile_name, tts_api) if with_audio else None
+            return export_notes(export_df, make_note, audio_clips, on_progress=lambda done, total: self.export_progress_signal.emit((done, total)))
+
+        self.export_rows = export_df
+        self.export_table_rows = self.table_model.data_frame
+        self.export_button.setEnabled(False)
+        self.export_progress_bar.setRange(0, len(export_df))
+        self.export_progress_bar.setValue(0)
+        self.export_progress_bar.show()
+        self.thread_pool.start(GenerationWorker(job, self.export_finished_signal, threading.Event()))
+
+    def on_export_progress(self, payload):
+        n_done, n_total = payload
+        self.export_progress_bar.setMaximum(n_total)
+        self.export_progress_bar.setValue(n_done)
+
+    def on_export_finished(self, payload):
+        from decks_homepage import DecksHomepageQt
+
+        _, results = payload
+        self.export_progress_bar.hide()
+        self.export_button.setEnabled(True)
+
+        if isinstance(results, Exception):
+            QMessageBox.critical(self, "Export Error", str(results))
+            return
+
+        # Cards that were added, or that Anki already had, are done with: untick them so exporting again only retries the rest.
+        # Only do it if the table still shows the rows that were exported, since their index is their row number in it.
+        done = results['status'].isin(['added', 'duplicate'])
+        if self.table_model.data_frame is self.export_table_rows:
+            self.table_model.set_checked(results.index[done], False)
+
+        failed = results[~done]
+        n_duplicates = int((results['status'] == 'duplicate').sum())
+        if failed.empty:
+            skipped = f" {n_duplicates} were already in Anki and were skipped." if n_duplicates else ""
+            QMessageBox.information(self, "Success", "Cards successfully created in Anki." + skipped)
+
+            # Return to the decks homepage
+            self.controller.show_frame(DecksHomepageQt)
+            return
+
+        # Stay on this frame, so the rows that failed can be exported again
+        message = QMessageBox(QMessageBox.Warning, "Export Error", f"{len(failed)} of {len(results)} cards could not be created.", parent=self)
+        message.setDetailedText("\n".join(
+            f"{self.export_rows.loc[index, 'sentence']}: {error}" for index, error in failed['error'].fillna('Not exported').items()
+        ))
+        message.exec_()
+
+class GenerationWorker(QRunnable):
+    """Runs a generation job off the UI thread and emits `(cancel_event, result)` when it's done."""
+    def __init__(self, job, signal, cancel_event):
+        super().__init__()
+        self.job = job
+        self.signal = signal
+        self.cancel_event = cancel_event
+
+    def run(self):
+        try:
+            result = self.job(self.cancel_event)
+        except Exception as e:
+            result = e
+        self.signal.emit((self.cancel_event, result))
+
 class FadeLabel(QLabel):
     def __init__(self, text, parent=None):
         super().__init__(text, parent)
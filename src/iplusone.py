@@ -1,13 +1,11 @@
-from PyQt5.QtWidgets import QMessageBox,  QLabel, QCheckBox, QTreeWidgetItem
+from PyQt5.QtWidgets import QMessageBox,  QLabel, QCheckBox, QHBoxLayout, QComboBox
 from PyQt5.QtCore import pyqtSignal, pyqtProperty
 from PyQt5.QtGui import QPalette
-import pandas as pd
 from generating_frame import GeneratingFrameQt
 import sys
 sys.path.append("../utils/")
-from utils.text_generating_functions import generate_text
-from utils.audio_generating_functions import generate_audio
-from utils.anki_connect_functions import create_new_card
+from utils.text_generating_functions import generate_until_quota, select_prompt_vocab, MAX_GENERATION_ROUNDS
+from utils.anki_connect_functions import build_note
 from utils.prompt_loader import load_prompt
 
 EXPORT_CONFIG = {
@@ -41,22 +39,119 @@ class IPlusOneFrameQt(GeneratingFrameQt):
 
     def initUI(self):
         super().initUI()
+
+        # Picklist for splitting the request into concurrent sub-prompts
+        shards_layout = QHBoxLayout()
+        self.shards_label = QLabel('Parallel requests:', self)
+        self.shards_picklist = QComboBox(self)
+        self.shards_picklist.addItems(['1', '2', '3', '4', '5'])
+        self.shards_picklist.setCurrentIndex(0)
+        shards_layout.addWidget(self.shards_label)
+        shards_layout.addWidget(self.shards_picklist)
+        self.main_layout.insertLayout(self.main_layout.indexOf(self.generate_button), shards_layout)
+
+        # Picklist for capping how much of the learned vocabulary goes into the prompt
+        budget_layout = QHBoxLayout()
+        self.vocab_budget_label = QLabel('Learned words in prompt:', self)
+        self.vocab_budget_picklist = QComboBox(self)
+        self.vocab_budget_picklist.addItems(['250', '500', '1000', '2000', '4000', 'All'])
+        self.vocab_budget_picklist.setCurrentText('1000')
+        budget_layout.addWidget(self.vocab_budget_label)
+        budget_layout.addWidget(self.vocab_budget_picklist)
+        self.main_layout.insertLayout(self.main_layout.indexOf(self.generate_button), budget_layout)
+
+        # Keep the sentences that pass and automatically ask for more until there are N of them
+        self.retry_checkbox = QCheckBox(f'Retry until N sentences meet the criterion (up to {MAX_GENERATION_ROUNDS} rounds)', self)
+        self.retry_checkbox.setChecked(True)
+        self.main_layout.insertWidget(self.main_layout.indexOf(self.generate_button), self.retry_checkbox)
            
     def on_press_generate(self):
         n_sentences = int(self.nsentences_picklist.currentText())
+        max_rounds = MAX_GENERATION_ROUNDS if self.retry_checkbox.isChecked() else 1
+
+        # Read the widgets here on the UI thread: retry prompts are built on the worker thread
+        n_shards = int(self.shards_picklist.currentText())
+        budget = self.vocab_budget_picklist.currentText()
+        budget = None if budget == 'All' else int(budget)
+        vocab = {
+            'language': self.controller.selected_language,
+            'learned_tokens': self.controller.learned_deck_tokens,
+            'new_tokens': self.controller.new_deck_tokens,
+            'context_notes': self.controller.deck_note_tokens.get('new_deck'),
+        }
+
+        def build_prompts(n_sentences, forbidden_words=None):
+            prompts, _ = self.build_shard_prompts(vocab, n_sentences, n_shards, budget, forbidden_words)
+            return prompts
+
+        prompts, n_prompt_vocab = self.build_shard_prompts(vocab, n_sentences, n_shards, budget)
+
+        # Declare the prompt
+        self.prompt = prompts[0]
+        self.show_prompt_size(prompts, n_prompt_vocab)
+    
+        # Generate sentences on a worker thread; the results come back through update_ui_signal
+        request = self.generation_request()
+        request['prompts'] = prompts
+        self.start_generation(lambda cancel_event, on_rows: generate_until_quota(
+            request, build_prompts, n_sentences, cancel_event, on_rows, max_rounds=max_rounds
+        ))
+
+    def build_shard_prompts(self, vocab, n_sentences, n_shards, budget, forbidden_words=None):
+        """
+        Renders the prompts for one round of `n_sentences` sentences, split into at most
+        `n_shards` concurrent requests. This runs on the worker thread for retry rounds, so everything
+        it needs from the controller is passed in `vocab`, snapshotted on the UI thread.
+
+        Returns:
+        - tuple: The list of prompts, and the largest number of learned words any of them carries.
+        """
+        # Split the request into at most one shard per sentence
+        n_shards = min(n_shards, n_sentences)
 
         # Build new-words instruction depending on whether the new deck has tokens
         NEW_DECK_THRESHOLD = 5
-        new_deck = self.controller.new_deck_tokens
+        new_deck = vocab['new_tokens']
 
         if len(new_deck) >= NEW_DECK_THRESHOLD:
             sampled_new = new_deck.sample(
                 n=min(n_sentences, len(new_deck)), replace=False
             )
+        else:
+            sampled_new = None
+
+        # Give each shard an even share of the sentences and its own, disjoint share of the new words
+        prompts = []
+        n_prompt_vocab = 0
+        for shard in range(n_shards):
+            shard_n_sentences = n_sentences // n_shards + (1 if shard < n_sentences % n_shards else 0)
+            shard_new_words = sampled_new.iloc[shard::n_shards] if sampled_new is not None else None
+            prompt, n_vocab = self.build_prompt(vocab, shard_n_sentences, shard_new_words, budget, forbidden_words)
+            prompts.append(prompt)
+            n_prompt_vocab = max(n_prompt_vocab, n_vocab)
+        return prompts, n_prompt_vocab
+
+    def build_prompt(self, vocab, n_sentences, new_words, budget, forbidden_words=None):
+        """
+        Renders the i+1 prompt for `n_sentences` sentences. If `new_words` is None,
+        the model is asked to pick its own new words instead. `forbidden_words` are
+        words that got earlier sentences rejected.
+
+        Returns:
+        - tuple: The prompt, and the number of learned words it carries.
+        """
+        learned_tokens = select_prompt_vocab(
+            vocab['learned_tokens'],
+            budget,
+            new_words=new_words,
+            context_notes=vocab['context_notes'],
+        )
+
+        if new_words is not None:
             new_words_instruction = (
                 "Today the student is trying to learn the following words, "
                 "which we can call the 'new words':\n"
-                f"{', '.join(sampled_new)}\n\n"
+                f"{', '.join(new_words)}\n\n"
                 "Each sentence must include _exactly one_ of these 'new words'."
             )
         else:
@@ -67,117 +162,47 @@ class IPlusOneFrameQt(GeneratingFrameQt):
                 "Try to pick a different new word for each sentence."
             )
 
-        # Declare the prompt
-        self.prompt = load_prompt(
+        forbidden_words_instruction = ""
+        if forbidden_words:
+            forbidden_words_instruction = (
+                "Do NOT use any of the following words, which the student has not learned "
+                "and which are not among the 'new words':\n"
+                f"{', '.join(forbidden_words)}"
+            )
+
+        prompt = load_prompt(
             "iplusone",
-            self.controller.selected_language,
-            language=self.controller.selected_language,
-            learned_tokens=", ".join(self.controller.learned_deck_tokens),
+            vocab['language'],
+            language=vocab['language'],
+            learned_tokens=", ".join(learned_tokens),
             new_words_instruction=new_words_instruction,
+            forbidden_words_instruction=forbidden_words_instruction,
             n_sentences=n_sentences,
         )
-    
-        self.loading_label.show()
-        self.generate_button.setEnabled(False)
-        self.animation.start()
-
-        try:
-            # Generate sentences
-            generated_sentences = generate_text(self)
-
-            # Update the UI after generation
-            self.update_ui_after_generation(generated_sentences, 'meets_criteria')
-
-        except ValueError as e:  # Catch the specific error raised in generate_text
-            QMessageBox.critical(self, "Generation Error", str(e))
-            generated_sentences = None  # Or handle this case as needed
-
-        self.animation.stop()
-        self.loading_label.hide()
-        self.generate_button.setEnabled(True)
+        return prompt, len(learned_tokens)
         
-    # Override interited method
-    def populate_treeview(self, data_frame):
-        self.table.clear()
-        self.table.setColumnCount(9)  # Assuming 9 columns including the checkbox column
-        self.table.setHeaderLabels([
-            'Export', 'Sentence', 'Translation', 'New Word', 
-            'Total Words', 'Known Words', 'New Words',
-            'Rogue Words', 'Meets Criteria'
-        ])
-
-        for row in data_frame.itertuples():
-            tree_item = QTreeWidgetItem(self.table)
-
-            # Checkbox in the first column
-            checkbox = QCheckBox()
-            checkbox.setChecked(row.meets_criteria)
-            self.table.setItemWidget(tree_item, 0, checkbox)
-
-            # Set other columns
-            tree_item.setText(1, str(row.sentence))
-            tree_item.setText(2, str(row.translation))
-            tree_item.setText(3, str(row.new_word))
-            tree_item.setText(4, str(row.n_words))
-            tree_item.setText(5, str(row.n_known_words))
-            tree_item.setText(6, str(row.n_new_words))
-            tree_item.setText(7, str(row.n_rogue_words))
-            tree_item.setText(8, str(row.meets_criteria))
-            
     def export_to_anki(self):
-        from decks_homepage import DecksHomepageQt
         
-        # Create a list to hold data for rows where the 'Export' checkbox is checked
-        export_data = []
-
-        # Iterate through the tree view items
-        for index in range(self.table.topLevelItemCount()):
-            item = self.table.topLevelItem(index)
-            # Check if the checkbox in the 'Export' column is checked
-            if self.table.itemWidget(item, 0).isChecked():
-                # Append the data of the row to the export_data list
-                export_data.append({
-                    'sentence': item.text(1),
-                    'translation': item.text(2),
-                    'new_word': item.text(3),
-                    'total_words': item.text(4),
-                    'known_words': item.text(5),
-                    'new_words': item.text(6),
-                    'rogue_words': item.text(7),
-                    'meets_criteria': item.text(8),
-                })
+        # Rows where the 'Export' checkbox is checked, read straight from the table model
+        export_df = self.table_model.checked_rows()
                 
-        if not export_data:
+        if export_df.empty:
             QMessageBox.warning(self, "Export Error", "Please check at least one item to export.")
             return  # Stop the function execution
 
-        # Create a DataFrame from the collected data
-        export_df = pd.DataFrame(export_data)
-        
-        # If the 'audio' checkbox is checked then generate the audio files and pack them into Anki's media folder
-        if self.audio_checkbox.isChecked():
-            export_df = generate_audio(export_df, self.controller.selected_language, self.controller.selected_profile_name, self.audio_source_picklist.currentText())
-        else:
-            export_df['audio'] = ' '
-
-        # Create the cards in Anki
+        # Create the cards in Anki, each one as soon as its audio is ready
         config = EXPORT_CONFIG.get(self.controller.selected_language, EXPORT_CONFIG['Hindi'])
-        result = export_df.apply(lambda row: create_new_card(
-            deck_name=self.controller.learned_deck,
-            gpt_model=self.model_picklist.currentText(),
-            audio_provider=self.audio_source_picklist.currentText(),
+        deck_name = self.controller.learned_deck
+        gpt_model = self.model_picklist.currentText()
+        audio_provider = self.audio_source_picklist.currentText()
+        self.start_export(export_df, lambda row: build_note(
+            deck_name=deck_name,
+            gpt_model=gpt_model,
+            audio_provider=audio_provider,
             anki_model=config['anki_model'],
             functionality="i+1",
             fields=config['fields'](row),
-        ), axis=1)
-        
-        if result.eq("success").all():
-            QMessageBox.information(self, "Success", "Cards successfully created in Anki.")
-        else:
-            QMessageBox.warning(self, "Export Error", "Cards could not be created.")
-            
-        # Return to the decks homepage        
-        self.controller.show_frame(DecksHomepageQt)
+        ))
         
 class FadeLabel(QLabel):
     def __init__(self, text, parent=None):
@@ -1,7 +1,8 @@
 from PyQt5.QtWidgets import QWidget, QLabel, QPushButton, QComboBox, QVBoxLayout, QGridLayout, QMessageBox, QDialog, QHBoxLayout, QLineEdit, QInputDialog, QScrollArea
 from PyQt5.QtCore import Qt
 import sqlite3
-from decks_homepage import DecksHomepageQt
+from utils.tokenizers import supported_languages
+from utils.database import get_connection
 
 class LanguageConfigFrameQt(QWidget):
     def __init__(self, parent=None):
@@ -61,18 +62,14 @@ class LanguageConfigFrameQt(QWidget):
         self.controller.show_frame(UserConfigFrameQt)
         
     def load_language_configurations_to_dropdown(self):
-        conn = sqlite3.connect('database.db')
-        c = conn.cursor()
+        conn = get_connection()
 
         # Access selected_user_id from the MainApp instance
-        c.execute("SELECT configuration_name FROM language_configurations WHERE user_id=?", (self.controller.selected_user_id,))
-        configurations = [row[0] for row in c.fetchall()]
+        configurations = [row[0] for row in conn.execute("SELECT configuration_name FROM language_configurations WHERE user_id=?", (self.controller.selected_user_id,))]
 
         self.configuration_dropdown.clear()
         self.configuration_dropdown.addItems(configurations)
 
-        conn.close()
-
     def add_new_configuration(self):
         # Create and show the dialog for new configuration
         dialog = NewLanguageConfigurationWindow(parent=self, lang_config_frame=None, selected_user_id=self.controller.selected_user_id)
@@ -87,39 +84,31 @@ class LanguageConfigFrameQt(QWidget):
             reply = QMessageBox.question(self, "Delete Configuration", "Are you sure you want to delete this language configuration?", QMessageBox.Yes | QMessageBox.No)
 
             if reply == QMessageBox.Yes:
-                conn = sqlite3.connect('database.db')
-                c = conn.cursor()
-        
+                conn = get_connection()
                 try:
-                    c.execute("DELETE FROM language_configurations WHERE configuration_name=? AND user_id=?", (configuration_name, self.controller.selected_user_id))
-                    conn.commit()
+                    with conn:
+                        conn.execute("DELETE FROM language_configurations WHERE configuration_name=? AND user_id=?", (configuration_name, self.controller.selected_user_id))
                 except sqlite3.Error as e:
                     QMessageBox.warning(self, "Error", f"Error deleting configuration from database: {e}")
-                finally:
-                    conn.close()
 
                 # Refresh the dropdown to reflect the change
                 self.load_language_configurations_to_dropdown()
 
     def execute_ankiconnect(self):
+        from decks_homepage import DecksHomepageQt
+
         # Get the selected configuration name from the dropdown
         self.controller.configuration_name = self.configuration_dropdown.currentText()
 
-        # Establish database connection
-        conn = sqlite3.connect('database.db')
-        c = conn.cursor()
-
         # Retrieve the configuration_language for the selected user_id and configuration name
-        c.execute("""
+        configuration_language = get_connection().execute("""
             SELECT configuration_language
             FROM language_configurations
             WHERE user_id = ? AND configuration_name = ?
-        """, (self.controller.selected_user_id, self.controller.configuration_name))
+        """, (self.controller.selected_user_id, self.controller.configuration_name)).fetchone()
         
-        # Fetch the result and save as a 'global' variable
-        configuration_language = c.fetchone()
+        # Save the result as a 'global' variable
         self.controller.selected_language = configuration_language[0]
-        conn.close()
 
         self.controller.show_frame(DecksHomepageQt)
         self.close() 
@@ -192,7 +181,7 @@ class NewLanguageConfigurationWindow(QDialog):
         language_layout = QHBoxLayout()
         language_layout.addWidget(QLabel("Select Language:", self))
         self.language_combobox = QComboBox(self)
-        self.language_combobox.addItems(["Arabic", "French", "Hindi", "Mandarin", "Turkish"])
+        self.language_combobox.addItems(supported_languages())
         language_layout.addWidget(self.language_combobox)
         layout.addLayout(language_layout)
 
@@ -229,8 +218,8 @@ class NewLanguageConfigurationWindow(QDialog):
             new_deck = self.new_deck_entry.text()
             configuration_language = self.language_combobox.currentText()
 
-            # Connect to the database and append all the info
-            conn = sqlite3.connect('database.db')
+            # Append all the info in one transaction
+            conn = get_connection()
             c = conn.cursor()
             try:
                 # Insert into language_configurations table
@@ -265,9 +254,8 @@ class NewLanguageConfigurationWindow(QDialog):
                 conn.commit()
                 QMessageBox.information(self, "Success", "Configuration saved successfully")
             except sqlite3.Error as e:
+                conn.rollback()
                 QMessageBox.warning(self, "Error", f"Error saving configuration to database: {e}")
-            finally:
-                conn.close()
 
             # Refresh dropdown in LanguageConfigFrame
             if self.lang_config_frame:
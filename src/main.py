@@ -1,16 +1,23 @@
+import time
+STARTUP_TIME = time.perf_counter()
+
 import sys
 import os
-import sqlite3
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
-from PyQt5.QtWidgets import QApplication, QMainWindow, QFrame, QVBoxLayout
+from PyQt5.QtWidgets import QApplication, QMainWindow, QFrame, QVBoxLayout, QMessageBox
+from PyQt5.QtCore import QTimer
+from utils.database import get_connection, close_connection
+
+# Only the first screen is imported up front. The other frames, and the pandas/requests/yaml
+# machinery they pull in, are imported the first time they're shown.
 from user_config import UserConfigFrameQt
-from language_config import LanguageConfigFrameQt
-from decks_homepage import DecksHomepageQt
-from iplusone import IPlusOneFrameQt
-from previous_cards_audio_frame import PreviousCardsAudioFrameQt
-from verb_exploder_frame import VerbExploderFrameQt
+
+IMPORT_TIME = time.perf_counter()
+
+# Set SPOONFED_STARTUP_TIMING=1 to print how long startup took
+STARTUP_TIMING_ENABLED = os.getenv("SPOONFED_STARTUP_TIMING", "0") == "1"
 
 # Main Application Class
 class MainApp(QMainWindow):
@@ -29,18 +36,16 @@ class MainApp(QMainWindow):
         self.selected_user_id = None
         self.selected_profile_name = None
         self.selected_language = None
+        self.configuration_id = None
         
         self.learned_deck_tokens = []
         self.new_deck_tokens = []
+        self.deck_note_tokens = {}
+        self.sentence_scorer = None
 
-        # Tell the app what frames exist. These are all classes we define below
-        # representing different screens in the UX.
+        # The frames are the different screens in the UX. Each one is only built
+        # the first time it's shown, then kept around for later.
         self.frames = {}
-        for F in (UserConfigFrameQt, LanguageConfigFrameQt, DecksHomepageQt, IPlusOneFrameQt, PreviousCardsAudioFrameQt, VerbExploderFrameQt):
-            frame = F(parent=self)
-            self.frames[F] = frame
-            self.layout.addWidget(frame)
-            frame.hide()
             
         # Start by showing the first frame
         self.show_frame(UserConfigFrameQt)
@@ -48,84 +53,51 @@ class MainApp(QMainWindow):
     def show_frame(self, page_class):
         for frame in self.frames.values():
             frame.hide()
+        if page_class not in self.frames:
+            frame = page_class(parent=self)
+            self.frames[page_class] = frame
+            self.layout.addWidget(frame)
         self.frames[page_class].show()
 
+    def closeEvent(self, event):
+        # Only close the shared AnkiConnect client if a frame has actually used it
+        anki_connect_functions = sys.modules.get('utils.anki_connect_functions')
+        if anki_connect_functions is not None:
+            anki_connect_functions.close_anki_client()
+
+        # Let the run ledger finish writing any runs that are still queued
+        run_ledger = sys.modules.get('utils.run_ledger')
+        if run_ledger is not None:
+            run_ledger.close_run_ledger()
+        close_connection()
+        super().closeEvent(event)
+
     def setup_database(self):
-        db_name = 'database.db'
-
-        # Check if the database already exists
-        if os.path.exists(db_name):
-            return
-
-        conn = sqlite3.connect(db_name)
-        c = conn.cursor()
-
-        # Create table for user configurations
-        c.execute('''CREATE TABLE IF NOT EXISTS users
-                     (id INTEGER PRIMARY KEY, profile_name TEXT UNIQUE)''')
-
-        # Create tables for language configurations
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS language_configurations (
-                id INTEGER PRIMARY KEY,
-                user_id INTEGER,
-                configuration_name TEXT,
-                configuration_language TEXT,
-                learned_deck TEXT,
-                new_deck TEXT,
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        ''')
-
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS card_types (
-                card_type_id INTEGER PRIMARY KEY,
-                configuration_id INTEGER,
-                card_type_name TEXT,
-                FOREIGN KEY(configuration_id) REFERENCES language_configurations(id)
-            )
-        ''')
-
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS card_fields (
-                field_id INTEGER PRIMARY KEY,
-                card_type_id INTEGER,
-                field_name TEXT,
-                FOREIGN KEY(card_type_id) REFERENCES card_types(card_type_id)
-            )
-        ''')
-        
-        # Create table for runs
-        c.execute('''CREATE TABLE IF NOT EXISTS runs
-                     (run_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      timestamp TEXT NOT NULL,
-                      gpt_model TEXT,
-                      audio_provider TEXT,
-                      language_configuration_id INTEGER,
-                      FOREIGN KEY(language_configuration_id) REFERENCES language_configurations(id))''')
-
-        # Create table for gpt_responses
-        c.execute('''CREATE TABLE IF NOT EXISTS gpt_responses
-                     (run_id INTEGER,
-                      n_sentences INTEGER,
-                      sentence_order INTEGER,
-                      sentence TEXT,
-                      translation TEXT,
-                      new_word TEXT,
-                      n_words INTEGER,
-                      n_known_words INTEGER,
-                      n_new_words INTEGER,
-                      n_rogue_words INTEGER,
-                      filter_condition TEXT,
-                      meets_criteria BOOLEAN,
-                      FOREIGN KEY(run_id) REFERENCES runs(run_id))''')
-
-        conn.commit()
-        conn.close()
+        # Opening the first connection creates the database, or brings an existing one up to the latest schema
+        get_connection()
+
+def check_prompts(parent):
+    """Loads and checks every prompt template, so a broken template is reported now rather than mid-generation."""
+    import yaml
+    from utils.prompt_loader import validate_prompts
+
+    try:
+        validate_prompts()
+    except (ValueError, yaml.YAMLError) as e:
+        QMessageBox.critical(parent, "Prompt Error", str(e))
         
 # Running the Application
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     mainApp = MainApp()
     mainApp.show()
+
+    # Check the prompt templates once the window is up
+    QTimer.singleShot(0, lambda: check_prompts(mainApp))
+
+    # Runs once the event loop has painted the first window
+    if STARTUP_TIMING_ENABLED:
+        QTimer.singleShot(0, lambda: print(
+            f"Startup: imports {IMPORT_TIME - STARTUP_TIME:.3f}s, first paint {time.perf_counter() - STARTUP_TIME:.3f}s"
+        ))
     sys.exit(app.exec_())
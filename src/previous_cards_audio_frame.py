@@ -1,12 +1,15 @@
-from PyQt5.QtWidgets import QHBoxLayout, QLabel, QCheckBox, QComboBox, QPushButton, QTreeWidgetItem, QDialog, QVBoxLayout
+from PyQt5.QtWidgets import QHBoxLayout, QLabel, QCheckBox, QComboBox, QPushButton, QDialog, QVBoxLayout
 from PyQt5.QtCore import pyqtSignal
 import pandas as pd
 from utils.anki_connect_functions import *
+from utils.token_cache import audio_flag_signature, load_cached_audio_flags, sync_cached_audio_flags
 from utils.audio_generating_functions import generate_audio
 from generating_frame import GeneratingFrameQt
 
 class PreviousCardsAudioFrameQt(GeneratingFrameQt):
     update_ui_signal = pyqtSignal(object)
+    check_column_header = 'Generate'
+    checked_by_default_column = 'no_audio'
     
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -21,9 +24,6 @@ class PreviousCardsAudioFrameQt(GeneratingFrameQt):
         
         # Load the learned cards from anki
         learned_cards = self.load_sentences_from_deck('learned_deck', self.configuration_data)
-  
-        # check whether any of the fields point to an audio file in Anki's media colletion
-        learned_cards = add_audio_flag(learned_cards)
 
         if learned_cards is not None:
             
@@ -69,129 +69,103 @@ class PreviousCardsAudioFrameQt(GeneratingFrameQt):
         - raw_config_data (dict): A dictionary where keys are card types and values are lists of fields.
 
         Returns:
-        - pd.DataFrame: A DataFrame with sentences from each field, the deck name, and the card type.
+        - pd.DataFrame: A DataFrame with sentences from each field, the deck name, the card type and a 'no_audio'
+          flag, or None if Anki could not be reached. Unchanged notes already known to have audio are left out.
         """
 
         # Extract deck and card_types_and_fields from the selected language configuration
         deck = raw_config_data.get(deck, None)
         raw_card_types_and_fields = raw_config_data.get('card_types_and_fields', {})
 
-        # Transform card_types_and_fields into the required format
+        # Transform card_types_and_fields into the required format. The configuration stores one row per field,
+        # but older ones may hold a comma-separated list in a single row, so accept both.
         card_types_and_fields = {}
         for card_type, fields in raw_card_types_and_fields.items():
-            clean_fields = [field.strip() for field in fields[0].split(',')]
+            clean_fields = [field.strip() for entry in fields for field in entry.split(',') if field.strip()]
             card_types_and_fields[card_type] = clean_fields
 
-        all_sentences = []
-        unique_fields = set()  # To store unique fields across all card types
+        # Retrieve every note of each card type, and the notes that still have an unsuspended card, in a single batched call
+        queries = [f'"deck:{deck}" "note:{card_type}"' for card_type in card_types_and_fields]
+        id_lists = ankiconnect_multi(self, [request('findNotes', query=q) for query in queries for q in (query, f'{query} -is:suspended')])
+        if id_lists == 1:
+            return None
+        note_ids_by_card_type = id_lists[0::2]
+        active_note_ids = {note_id for note_ids in id_lists[1::2] for note_id in note_ids}
 
-        for card_type, fields in card_types_and_fields.items():
-            # Construct the query for the card type
-            query = f'"deck:{deck}" "note:{card_type}"'
+        active_note_ids_in_order = [note_id for note_ids in note_ids_by_card_type for note_id in note_ids if note_id in active_note_ids]
 
-            # Retrieve note IDs for the card type
-            note_ids = ankiconnect_invoke(self, 'findNotes', query=query)
-            
-            card_ids = ankiconnect_invoke(self, 'findCards', query=query)
+        # Notes that were last seen with audio and haven't been modified since can be skipped without fetching them at all
+        signature = audio_flag_signature(deck, card_types_and_fields)
+        mod_times = fetch_notes_mod_time(self, active_note_ids_in_order)
+        if mod_times == 1:
+            return None
+        cached_flags = load_cached_audio_flags(signature) if mod_times is not None else {}
+        known_with_audio = {note_id for note_id, (mod, has_audio) in cached_flags.items() if has_audio and mod is not None and mod_times.get(note_id) == mod}
 
-            # Retrieve note content for the card type
-            note_content = pd.json_normalize(ankiconnect_invoke(self, 'notesInfo', notes=note_ids))
-            
-            # Remove suspended cards
-            to_suspend = check_suspended_status(card_ids)
-            mask = -pd.Series(to_suspend)
-            note_content = note_content[mask]
-            
-            # Accumulate unique field names across all card types
-            for col in note_content.columns:
-                if '.' in col:  # Assuming field names contain a dot
-                    unique_fields.add(col)
-
-            # Append rows to all_sentences list
-            for index, row in note_content.iterrows():
-                new_row = {field: row[field] if field in row else None for field in unique_fields}
-                new_row['note_id'] = row['noteId'] 
-                new_row['deck_name'] = deck
-                new_row['card_type'] = card_type
-                all_sentences.append(new_row)
-
-        # Convert the list of dictionaries to a DataFrame
-        new_df = pd.DataFrame(all_sentences)
-
-        # Filter columns to include only those ending with '.value'
-        value_columns = [col for col in new_df.columns if col.endswith('.value')]
-        final_columns = ['note_id', 'deck_name', 'card_type'] + value_columns
-
-        # Reorder the DataFrame and return
-        new_df = new_df[final_columns]
-        
-      #  new_df.to_csv("delete.csv", index=False)
-        return new_df
+        # Retrieve the content of the remaining notes in bounded pages
+        all_notes = fetch_notes_info(self, [note_id for note_id in active_note_ids_in_order if note_id not in known_with_audio])
+        if all_notes == 1:
+            return None
+        notes_by_id = {note['noteId']: note for note in all_notes if note}
+
+        # Build one columnar frame per card type, leaving out notes whose cards are all suspended
+        frames = []
+        for card_type, note_ids in zip(card_types_and_fields, note_ids_by_card_type):
+            notes = [notes_by_id[note_id] for note_id in note_ids if note_id in notes_by_id]
+            if not notes:
+                continue
+
+            # Every note of a card type has the same fields, so take their order from the first one
+            field_names = sorted(notes[0]['fields'], key=lambda field: notes[0]['fields'][field]['order'])
+            frame = pd.DataFrame({f'fields.{field}.value': [note['fields'][field]['value'] for note in notes] for field in field_names})
+            frame.insert(0, 'note_id', [note['noteId'] for note in notes])
+            frame.insert(1, 'deck_name', deck)
+            frame.insert(2, 'card_type', card_type)
+
+            # Flag the notes none of whose fields has a sound tag yet. Every field is searched, not just the configured
+            # ones, since audio is written to the last configured field and may have been added by hand anywhere else.
+            frames.append(add_audio_flag(frame, [f'fields.{field}.value' for field in field_names]))
+
+        if mod_times is not None:
+            sync_cached_audio_flags(
+                signature,
+                {note_id: (mod_times.get(note_id), not no_audio) for frame in frames for note_id, no_audio in zip(frame['note_id'], frame['no_audio'])},
+                set(cached_flags) - set(active_note_ids_in_order),
+            )
+
+        if not frames:
+            return pd.DataFrame(columns=['note_id', 'deck_name', 'card_type', 'no_audio'])
+
+        # Concatenate in one shot. Field columns appear in card type order, then note type field order.
+        return pd.concat(frames, ignore_index=True, sort=False)
     
     def populate_treeview(self, data_frame):
         """
-        Dynamically populate a tree view with data from a pandas DataFrame.
+        Show the cards from a pandas DataFrame in the table, with the ones missing audio checked for generation.
 
         Parameters:
         - data_frame (pd.DataFrame): DataFrame containing the data to be displayed.
         """
 
-        # Clear existing data in the tree view
-        self.table.clear()
-
         # Define standard and dynamic field headers
-        standard_headers = ['note_id', 'deck_name', 'card_type', 'no_audio']
-        standard_headers_clean = ['Note Id', 'Deck Name', 'Card Type', 'No Audio']
-        dynamic_headers = [col for col in data_frame.columns if col.startswith('fields.')]
-        dynamic_headers_clean = ['Field: ' + col.split('.')[1].replace('_', ' ').capitalize() for col in dynamic_headers]
-
-        # Combine the cleaned headers for display
-        all_headers_clean = ['Generate'] + standard_headers_clean + dynamic_headers_clean
-
-        # Set column count and headers using cleaned headers
-        self.table.setColumnCount(len(all_headers_clean))
-        self.table.setHeaderLabels(all_headers_clean)
-
-        # Populate the tree view with data
-        for _, row in data_frame.iterrows():
-            # Create a new tree item for each row
-            tree_item = QTreeWidgetItem(self.table)
-
-            # Add a checkbox in the 'Generate' column
-            gen_checkbox = QCheckBox()
-            no_audio_val = row['no_audio'] if 'no_audio' in data_frame.columns and not pd.isna(row['no_audio']) else False
-            gen_checkbox.setChecked(no_audio_val)
-            self.table.setItemWidget(tree_item, 0, gen_checkbox)  # Set the checkbox in the first column
-
-            # Process other standard headers
-            for idx, header in enumerate(standard_headers):
-                if header in data_frame.columns:
-                    if header == 'no_audio':  # Non-editable checkbox for 'No Audio'
-                        checkbox = QCheckBox()
-                        checkbox.setChecked(no_audio_val)
-                        checkbox.setEnabled(False)
-                        self.table.setItemWidget(tree_item, idx + 1, checkbox)  # Adjusted index due to 'Generate' column
-                    else:
-                        tree_item.setText(idx + 1, str(row[header]) if not pd.isna(row[header]) else "")  # Adjusted index due to 'Generate' column
-
-            # Process dynamic field headers
-            dynamic_col_idx = len(standard_headers) + 1  # Adjust for the added 'Generate' column
-            for col in dynamic_headers:
-                if col in data_frame.columns:
-                    tree_item.setText(dynamic_col_idx, str(row[col]) if not pd.isna(row[col]) else "")
-                    dynamic_col_idx += 1
+        standard_headers = [('note_id', 'Note Id'), ('deck_name', 'Deck Name'), ('card_type', 'Card Type'), ('no_audio', 'No Audio')]
+        dynamic_headers = [
+            (col, 'Field: ' + col.split('.')[1].replace('_', ' ').capitalize())
+            for col in data_frame.columns if col.startswith('fields.')
+        ]
+        self.table_columns = [(col, header) for col, header in standard_headers if col in data_frame.columns] + dynamic_headers
+
+        # The model renders rows lazily, so this is cheap however many cards there are
+        self.table_model.set_columns(self.table_columns)
+        self.table_model.set_rows(data_frame, data_frame.get('no_audio', False))
 
     def export_to_anki(self, raw_config_data):
         from decks_homepage import DecksHomepageQt
         
-        tree_data = []
-        for index in range(self.table.topLevelItemCount()):
-            item = self.table.topLevelItem(index)
-            if self.table.itemWidget(item, 0).isChecked():
-                row_data = {self.table.headerItem().text(i): item.text(i) for i in range(1, self.table.columnCount())}
-                tree_data.append(row_data)
-
-        df = pd.DataFrame(tree_data)
+        # Read the checked rows from the table model, keyed by their column headers as shown in the table
+        checked_rows = self.table_model.checked_rows()
+        df = checked_rows[[col for col, _ in self.table_columns]].rename(columns=dict(self.table_columns))
+        df = df.astype(object).where(df.notna(), '').astype(str)
         df['relevant_fields'] = df.apply(lambda row: [col for col in df.columns if col.startswith('Field:') and row[col] != ''], axis=1)
         df['sentence'] = None
 
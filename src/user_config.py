@@ -1,20 +1,28 @@
 from PyQt5.QtWidgets import QWidget, QLabel, QComboBox, QPushButton, QVBoxLayout, QGridLayout, QInputDialog
-from PyQt5.QtCore import Qt, pyqtSignal
-from PyQt5.QtGui import QPixmap, QCursor, QFont, QFontDatabase
-import sqlite3
+from PyQt5.QtCore import Qt, pyqtSignal, QRunnable, QThreadPool
+from PyQt5.QtGui import QPixmap, QImage, QColor, QCursor, QFont, QFontDatabase
 import webbrowser
 import os
 import random
+import uuid
+from utils.database import get_connection
+
+# Splash images are shown from pre-scaled thumbnails, which are re-rendered whenever their source image changes
+IMAGE_FOLDER = 'assets/images'
+THUMBNAIL_FOLDER = 'assets/thumbnails'
+THUMBNAIL_SIZE = (300, 450)
 
-from language_config import LanguageConfigFrameQt
 
 # Assuming LanguageConfigFrame is also converted to PyQt5
 # from language_config_qt import LanguageConfigFrameQt
 
 class UserConfigFrameQt(QWidget):
+    thumbnail_ready_signal = pyqtSignal(object)
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.controller = parent
+        self.thumbnail_ready_signal.connect(self.on_thumbnail_ready)
         self.create_user_config_frame()
         self.load_all_saved_users()
         self.setFixedSize(300, 500)
@@ -68,18 +76,13 @@ class UserConfigFrameQt(QWidget):
         self.anki_profile_label.setStyleSheet("QLabel { color: #555; }")
 
     def load_all_saved_users(self):
-        conn = sqlite3.connect('database.db')
-        c = conn.cursor()
-
-        c.execute("SELECT profile_name FROM users")
-        user_profiles = [row[0] for row in c.fetchall()]
+        conn = get_connection()
+        user_profiles = [row[0] for row in conn.execute("SELECT profile_name FROM users")]
 
         self.saved_users_dropdown.addItems(user_profiles)
         if user_profiles:
             self.saved_users_dropdown.setCurrentIndex(0)
 
-        conn.close()
-
     def add_new_user(self):
         new_user, ok = QInputDialog.getText(self, "Input", "Enter new user profile name:")
         if ok and new_user:
@@ -87,41 +90,77 @@ class UserConfigFrameQt(QWidget):
             self.load_all_saved_users()
 
     def set_user_configuration(self, user_name):
-        conn = sqlite3.connect('database.db')
-        c = conn.cursor()
-
-        c.execute("INSERT OR IGNORE INTO users (profile_name) VALUES (?)", (user_name,))
-        conn.commit()
+        conn = get_connection()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO users (profile_name) VALUES (?)", (user_name,))
 
-        c.execute("SELECT id FROM users WHERE profile_name=?", (user_name,))
-        self.controller.selected_user_id = c.fetchone()[0]
-        
-        c.execute("SELECT profile_name FROM users WHERE profile_name=?", (user_name,))
-        self.controller.selected_profile_name = c.fetchone()[0]
-
-        conn.close()
+        self.controller.selected_user_id, self.controller.selected_profile_name = conn.execute(
+            "SELECT id, profile_name FROM users WHERE profile_name=?", (user_name,)
+        ).fetchone()
 
     def proceed_with_selected_user(self):
+        from language_config import LanguageConfigFrameQt
+
         selected_user = self.saved_users_dropdown.currentText()
         if selected_user:
             self.set_user_configuration(selected_user)
             self.controller.show_frame(LanguageConfigFrameQt)
             
     def display_random_image(self):
-        image_folder = 'assets/images'
-        images = [img for img in os.listdir(image_folder) if img.endswith('.png')]
+        images = [img for img in os.listdir(IMAGE_FOLDER) if img.endswith('.png')]
         if images:
             selected_image = random.choice(images)
-            pixmap = QPixmap(os.path.join(image_folder, selected_image))
-            image_label = ClickableLabel(self)
-            image_label.setPixmap(pixmap.scaled(300, 450)) # Adjust size as needed
-            image_label.clicked.connect(self.on_image_click)
-            self.layout().addWidget(image_label)
+
+            # Show a placeholder straight away, and swap the image in once it has loaded in the background
+            placeholder = QPixmap(*THUMBNAIL_SIZE)
+            placeholder.fill(QColor('#eeeeee'))
+            self.image_label = ClickableLabel(self)
+            self.image_label.setFixedSize(*THUMBNAIL_SIZE)
+            self.image_label.setPixmap(placeholder)
+            self.image_label.clicked.connect(self.on_image_click)
+            self.layout().addWidget(self.image_label)
+
+            QThreadPool.globalInstance().start(ThumbnailLoader(os.path.join(IMAGE_FOLDER, selected_image), self.thumbnail_ready_signal))
+
+    def on_thumbnail_ready(self, image):
+        # QPixmaps can only be made on the UI thread, so the loader hands over a QImage
+        if not image.isNull():
+            self.image_label.setPixmap(QPixmap.fromImage(image))
         
     def on_image_click(self):
         url = "https://github.com/alex-rand/spoonfed" 
         webbrowser.open(url)
 
+class ThumbnailLoader(QRunnable):
+    """
+    Loads the thumbnail of an image off the UI thread, rendering it into THUMBNAIL_FOLDER first if it's
+    missing or older than its source. Emits the thumbnail as a QImage (a null one if the source can't be read).
+    """
+    def __init__(self, source_path, signal):
+        super().__init__()
+        self.source_path = source_path
+        self.signal = signal
+
+    def run(self):
+        width, height = THUMBNAIL_SIZE
+        name = os.path.splitext(os.path.basename(self.source_path))[0]
+        thumbnail_path = os.path.join(THUMBNAIL_FOLDER, f"{name}-{width}x{height}.png")
+
+        if os.path.exists(thumbnail_path) and os.path.getmtime(thumbnail_path) >= os.path.getmtime(self.source_path):
+            image = QImage(thumbnail_path)
+        else:
+            image = QImage(self.source_path)
+            if not image.isNull():
+                image = image.scaled(width, height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+                # Write under a temporary name and move it into place, so a half-written thumbnail is never read
+                os.makedirs(THUMBNAIL_FOLDER, exist_ok=True)
+                tmp_path = f"{thumbnail_path}.{uuid.uuid4().hex}.png"
+                if image.save(tmp_path):
+                    os.replace(tmp_path, thumbnail_path)
+
+        self.signal.emit(image)
+
 class ClickableLabel(QLabel):
     clicked = pyqtSignal()  # Signal to be emitted when the label is clicked
 
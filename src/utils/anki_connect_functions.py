@@ -1,19 +1,89 @@
-import json
-import urllib.request
-import urllib.error
 import sqlite3
 import re
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PyQt5.QtWidgets import QMessageBox
+from utils.database import get_connection
+from utils.tokenizers import get_tokenizer, HTML_TAG_PATTERN, SOUND_TAG_PATTERN, CLOZE_PATTERN, PUNCTUATION_PATTERN
+
+ANKICONNECT_URL = 'http://127.0.0.1:8765'
+
+# (connect, read) timeouts in seconds. Reads are generous because big notesInfo pages take a while to serialize.
+ANKICONNECT_TIMEOUT = (3.05, 120)
+
+# Maximum number of actions packed into a single AnkiConnect 'multi' call
+MULTI_BATCH_SIZE = 50
+
+# Maximum number of note IDs requested by a single 'notesInfo' action
+NOTES_INFO_CHUNK_SIZE = 500
+
+# Maximum number of notes sent by a single 'addNotes' action
+ADD_NOTES_CHUNK_SIZE = 100
 
 def request(action, **params):
     return {'action': action, 'params': params, 'version': 6}
 
+class AnkiConnectClient:
+    """
+    Pooled HTTP client for AnkiConnect that keeps its connections alive between calls.
+    One is created on first use and shared by every frame (see get_anki_client()); MainApp closes it on exit.
+    """
+    def __init__(self, url=ANKICONNECT_URL, timeout=ANKICONNECT_TIMEOUT, retries=3, backoff_factor=0.3, pool_size=8):
+        self.url = url
+        self.timeout = timeout
+
+        # Retry refused connections and server errors with exponential backoff. Read errors are not
+        # retried, since the action may already have been applied (e.g. a duplicate 'addNote').
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+
+    def invoke(self, action, **params):
+        response = self.session.post(self.url, json=request(action, **params), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+_anki_client = None
+
+def set_anki_client(client):
+    """Makes `client` the AnkiConnectClient used by every AnkiConnect call in the app."""
+    global _anki_client
+    _anki_client = client
+
+def get_anki_client():
+    """Returns the shared AnkiConnectClient, creating one with default settings if none has been set."""
+    global _anki_client
+    if _anki_client is None:
+        _anki_client = AnkiConnectClient()
+    return _anki_client
+
+def close_anki_client():
+    """Closes the shared AnkiConnectClient's connections, if one was ever created."""
+    global _anki_client
+    if _anki_client is not None:
+        _anki_client.close()
+        _anki_client = None
+
 # Function to send requests to Ankiconnect
 def ankiconnect_invoke(calling_frame, action, **params):
-    requestJson = json.dumps(request(action, **params)).encode('utf-8')
     try:
-        response = json.load(urllib.request.urlopen(urllib.request.Request('http://127.0.0.1:8765', requestJson)))
-    except urllib.error.URLError as e:
+        response = get_anki_client().invoke(action, **params)
+    except requests.exceptions.RequestException as e:
         QMessageBox.critical(calling_frame, "Connection Error", "Unable to connect with your Anki profile: make sure Anki is currently open")
         return 1
     if len(response) != 2:
@@ -26,34 +96,181 @@ def ankiconnect_invoke(calling_frame, action, **params):
         raise Exception(response['error'])
     return response['result']
 
-def create_new_card(deck_name, gpt_model, audio_provider, anki_model, fields, functionality):
+def ankiconnect_multi(calling_frame, actions):
+    """
+    Sends many AnkiConnect actions in as few round-trips as possible using the 'multi' action.
+
+    Parameters:
+    - calling_frame (QWidget): The frame to show connection errors on, or None.
+    - actions (list): Action dicts as built by request().
+
+    Returns:
+    - list: The result of each action, in the same order as the actions, or 1 if Anki could not be reached.
+    """
+    results = []
+    for start in range(0, len(actions), MULTI_BATCH_SIZE):
+        responses = ankiconnect_invoke(calling_frame, 'multi', actions=actions[start:start + MULTI_BATCH_SIZE])
+        if responses == 1:
+            return 1
+
+        # Each versioned action comes back wrapped in its own {'result', 'error'} envelope
+        for response in responses:
+            if isinstance(response, dict) and set(response) == {'result', 'error'}:
+                if response['error'] is not None:
+                    raise Exception(response['error'])
+                response = response['result']
+            results.append(response)
+
+    return results
+
+def _invoke_paged_by_notes(calling_frame, action, note_ids):
+    # Page the note IDs into bounded chunks and send all of the chunks through a single batched 'multi' call
+    note_ids = [int(note_id) for note_id in note_ids]
+    if not note_ids:
+        return []
+
+    actions = [
+        request(action, notes=note_ids[start:start + NOTES_INFO_CHUNK_SIZE])
+        for start in range(0, len(note_ids), NOTES_INFO_CHUNK_SIZE)
+    ]
+    pages = ankiconnect_multi(calling_frame, actions)
+    if pages == 1:
+        return 1
+
+    return [item for page in pages for item in page]
+
+def fetch_notes_info(calling_frame, note_ids):
+    """
+    Fetches 'notesInfo' for any number of notes, paging the IDs into bounded chunks.
+
+    Parameters:
+    - calling_frame (QWidget): The frame to show connection errors on, or None.
+    - note_ids (list): The note IDs to fetch.
+
+    Returns:
+    - list: One notesInfo dict per note ID, or 1 if Anki could not be reached.
+    """
+    return _invoke_paged_by_notes(calling_frame, 'notesInfo', note_ids)
+
+def fetch_notes_mod_time(calling_frame, note_ids):
+    """
+    Fetches the last modification time of any number of notes.
+
+    Parameters:
+    - calling_frame (QWidget): The frame to show connection errors on, or None.
+    - note_ids (list): The note IDs to look up.
+
+    Returns:
+    - dict: Note ID -> modification timestamp, 1 if Anki could not be reached,
+      or None if this version of AnkiConnect doesn't support 'notesModTime'.
+    """
+    try:
+        mod_times = _invoke_paged_by_notes(calling_frame, 'notesModTime', note_ids)
+    except Exception:
+        return None
+    if mod_times == 1:
+        return 1
+
+    return {item['noteId']: item['mod'] for item in mod_times}
+
+def build_note(deck_name, gpt_model, audio_provider, anki_model, fields, functionality):
 
     # The AnkiConnect API needs a particular nested structure to create a new note,
     # as documented under 'addNote' here: https://github.com/FooSoft/anki-connect
 
     # Structure the note according to AnkiConnect's requirements
-    note = {
+    return {
         'deckName': deck_name,
         'modelName': anki_model,
         'fields': fields,
         'tags': ["spoonfed", gpt_model, audio_provider, functionality]
     }
+
+def create_new_card(deck_name, gpt_model, audio_provider, anki_model, fields, functionality):
+    """Adds a single note. Returns "success", or the reason the note couldn't be added."""
+
+    note = build_note(deck_name, gpt_model, audio_provider, anki_model, fields, functionality)
  
     # Call
-    ankiconnect_invoke(None, 'addNote', note=note)
+    try:
+        result = add_notes([note])[0]
+    except requests.exceptions.RequestException:
+        return "Unable to connect with your Anki profile: make sure Anki is currently open"
     
-    return("success")
+    return "success" if result['status'] == 'added' else result['error']
 
-def check_suspended_status(note_ids):
-    # The request for 'areSuspended' requires a list of card IDs
-    params = {
-        'cards': note_ids
-    }
+def _invoke_raising(action, **params):
+    # Like ankiconnect_invoke, but raises on connection problems instead of showing a message box,
+    # so that it's safe to use off the UI thread
+    response = get_anki_client().invoke(action, **params)
+    if response['error'] is not None:
+        raise Exception(response['error'])
+    return response['result']
 
-    # Call ankiconnect_invoke with the 'areSuspended' action and the card IDs
-    result = ankiconnect_invoke(None, 'areSuspended', **params)
+def _multi_envelopes(actions):
+    # Sends actions through 'multi' and returns each one's (result, error) pair rather than raising on the first error
+    envelopes = []
+    for start in range(0, len(actions), MULTI_BATCH_SIZE):
+        for response in _invoke_raising('multi', actions=actions[start:start + MULTI_BATCH_SIZE]):
+            if isinstance(response, dict) and set(response) == {'result', 'error'}:
+                envelopes.append((response['result'], response['error']))
+            else:
+                envelopes.append((response, None))
+    return envelopes
 
-    return result
+def add_notes(notes, chunk_size=ADD_NOTES_CHUNK_SIZE):
+    """
+    Adds any number of notes in bulk, reporting on every note rather than failing the whole batch.
+    Notes Anki would refuse (duplicates, empty first fields) are weeded out with one 'canAddNotes' call,
+    then every chunk's 'addNotes' goes out in one 'multi' call. A chunk that still fails is retried note
+    by note, so one bad note never costs the rest of its chunk. Safe to call off the UI thread.
+
+    Parameters:
+    - notes (list): Note dicts as built by build_note().
+    - chunk_size (int): Optional. The most notes sent by a single 'addNotes' action.
+
+    Returns:
+    - list: One dict per note, in order: 'status' ('added', 'duplicate' or 'failed'), 'note_id' and 'error'.
+      Connection problems are raised as requests exceptions.
+    """
+    results = [None] * len(notes)
+    if not notes:
+        return results
+
+    # Pre-check every note in one round-trip
+    can_add = _invoke_raising('canAddNotes', notes=notes)
+    addable = []
+    for position, ok in enumerate(can_add):
+        if ok:
+            addable.append(position)
+        else:
+            results[position] = {'status': 'duplicate', 'note_id': None, 'error': "Anki can't add this note: it's a duplicate or its first field is empty"}
+
+    chunks = [addable[start:start + chunk_size] for start in range(0, len(addable), chunk_size)]
+    envelopes = _multi_envelopes([request('addNotes', notes=[notes[position] for position in chunk]) for chunk in chunks])
+
+    retry = []
+    for chunk, (note_ids, error) in zip(chunks, envelopes):
+        if error is not None:
+            retry.extend(chunk)
+            continue
+
+        # Older versions of AnkiConnect report refused notes as nulls rather than an error
+        for position, note_id in zip(chunk, note_ids):
+            if note_id:
+                results[position] = {'status': 'added', 'note_id': note_id, 'error': None}
+            else:
+                results[position] = {'status': 'failed', 'note_id': None, 'error': "Anki refused the note"}
+
+    # Find out exactly which notes of a failed chunk were the problem
+    if retry:
+        for position, (note_id, error) in zip(retry, _multi_envelopes([request('addNote', note=notes[position]) for position in retry])):
+            if error is None and note_id:
+                results[position] = {'status': 'added', 'note_id': note_id, 'error': None}
+            else:
+                results[position] = {'status': 'failed', 'note_id': None, 'error': error or "Anki refused the note"}
+
+    return results
 
 def get_model_names():
     
@@ -65,10 +282,8 @@ def fetch_user_configuration(calling_frame, user_id, configuration_name):
         """
         Fetches the user's language learning configurations from the database.
         """
-        conn = None
         try:
-            conn = sqlite3.connect('database.db')
-            c = conn.cursor()
+            c = get_connection().cursor()
 
             # Fetch basic configuration details
             c.execute("""
@@ -97,6 +312,7 @@ def fetch_user_configuration(calling_frame, user_id, configuration_name):
                     card_types_and_fields[card_type].append(field)
 
                 res = {
+                    'configuration_id': config_id,
                     'configuration_language': config_language,
                     'learned_deck': learned_deck,
                     'new_deck': new_deck,
@@ -115,9 +331,6 @@ def fetch_user_configuration(calling_frame, user_id, configuration_name):
         except sqlite3.Error as e:
             QMessageBox.critical(calling_frame, "Database Error", f"Database error: {e}")
             return None
-        finally:
-            if conn:
-                conn.close()
                 
 def remove_non_language_tokens(text, language):
         """
@@ -130,97 +343,153 @@ def remove_non_language_tokens(text, language):
         Returns:
         - str: The filtered text containing only characters of the specified language.
         """
-        if language == 'Hindi':
-            pattern = "[^\u0900-\u097F \n]"
-        elif language == 'Arabic':
-            pattern = "[^\u0600-\u06FF \n]"
-        elif language == 'Mandarin':
-            pattern = "[^\u4e00-\u9fff \n]"
-        elif language == 'French':
-            pattern = "[^a-zA-ZÀ-ÿœŒ \n]"
-        elif language == 'Turkish':
-            pattern = "[^a-zA-ZÀ-ÿğĞıİşŞçÇöÖüÜ \n]"
-        else:
-            raise ValueError("Unsupported language")
-
-        return re.sub(pattern, '', text)
+        return get_tokenizer(language).remove_non_language(text)
     
 def strip_html_and_cloze(text):
     # Remove HTML tags
-    text = re.sub(r'<[^>]+>', '', text)
+    text = HTML_TAG_PATTERN.sub('', text)
     # Remove Anki sound tags (e.g., "[sound:filename.mp3]")
-    text = re.sub(r'\[sound:[^\]]+\]', '', text)
+    text = SOUND_TAG_PATTERN.sub('', text)
     # Remove Anki Cloze notation, keeping the visible text part (e.g., "{{c1::दे दो::…देना…}}" -> "दे दो देना")
-    text = re.sub(r'\{\{c\d+::([^:]+)::[^}]+\}\}', r'\1', text)
+    text = CLOZE_PATTERN.sub(r'\1', text)
     return text
 
 def strip_punctuation(text):
-    text = re.sub("\u0964", '', text)
+    text = PUNCTUATION_PATTERN.sub('', text)
     return text
+
+def tokenize_series(texts, language):
+    """
+    Splits a series of raw field values into vocabulary tokens using the language's registered tokenizer.
+
+    Parameters:
+    - texts (pd.Series): Raw field values, which may contain HTML, sound tags and Cloze notation.
+    - language (str): The language of the vocabulary.
+
+    Returns:
+    - pd.Series: One row per token, indexed by the index of the text it came from.
+    """
+    return get_tokenizer(language).tokenize_series(texts)
+
+def tokenize_notes(notes, fields, language):
+    """
+    Extracts the vocabulary tokens from the specified fields of many notes at once.
+
+    Parameters:
+    - notes (list): Notes as returned by AnkiConnect's 'notesInfo'.
+    - fields (list): The names of the fields to take vocabulary from.
+    - language (str): The language of the vocabulary.
+
+    Returns:
+    - dict: Note ID -> list of tokens, in field order. Notes without any tokens map to an empty list.
+    """
+    note_ids = []
+    texts = []
+    for note in notes:
+        for field in fields:
+            if field in note['fields']:
+                note_ids.append(note['noteId'])
+                texts.append(note['fields'][field]['value'])
+
+    tokens = tokenize_series(pd.Series(texts, index=note_ids, dtype=object), language)
+    tokens_by_note = tokens.groupby(level=0, sort=False).agg(list).to_dict() if len(tokens) else {}
+
+    return {note['noteId']: tokens_by_note.get(note['noteId'], []) for note in notes}
     
-def add_audio_flag(df):
+# Sound tags pointing at any audio file Anki can play, e.g. '[sound:spoonfed-1a2b.mp3]'
+AUDIO_EXTENSIONS = ('mp3', 'wav', 'ogg', 'oga', 'opus', 'm4a', 'aac', 'flac', 'webm', 'spx', 'amr', '3gp')
+AUDIO_TAG_PATTERN = re.compile(r'\[sound:[^\]]+\.(?:' + '|'.join(AUDIO_EXTENSIONS) + r')\]', re.IGNORECASE)
+
+def add_audio_flag(df, columns=None):
     """
     Adds a 'no_audio' column to the dataframe. 
     This column is a boolean that indicates whether, for that row, 
-    at least one existing text column contains the specific substring pattern '[sound:--othercharacters---.mp3]'.
+    none of the given columns contains a sound tag such as '[sound:--othercharacters---.mp3]'.
 
     Args:
     df (pandas.DataFrame): The input dataframe.
+    columns (list): Optional. The columns to search, e.g. the configured note fields. Defaults to every text column.
 
     Returns:
     pandas.DataFrame: The dataframe with the 'no_audio' column added.
     """
+    if columns is None:
+        columns = [col for col in df.columns if df[col].dtype == object]
 
-    # Regular expression pattern to match the audio file string
-    audio_pattern = re.compile(r'\[sound:[^\]]+\.mp3\]')
+    # One vectorized regex pass per column, rather than a Python call per cell
+    has_audio = pd.Series(False, index=df.index)
+    for column in columns:
+        has_audio |= df[column].str.contains(AUDIO_TAG_PATTERN, na=False)
 
-    # Function to check if a cell contains the specific substring pattern
-    def contains_audio_string(x):
-        if isinstance(x, str) and audio_pattern.search(x):
-            return True
-        return False
-
-    # Apply the function across all text columns and check if any returns True
-    df['no_audio'] = df.map(contains_audio_string).any(axis=1)
-    
-    # Inverting the boolean value as we need 'True' for 'no_audio'
-    df['no_audio'] = ~df['no_audio']
+    df['no_audio'] = ~has_audio
 
     return df
 
 def append_audio_file_to_notes(df, last_fields):
-    
-    success_count = 0
-    error_list = []
-
-    for index, row in df.iterrows():
-        note_id = int(row['Note Id'])
-        card_type = row['Card Type']
-        audio_content = row['audio']
-
-        if card_type in last_fields:
-            field_to_update = last_fields[card_type]
+    """
+    Appends each row's audio to the last configured field of its note. Every note's current fields are
+    fetched with one chunked 'notesInfo', and all the updates are written back through batched 'multi' calls.
 
-            # Fetch current note content
-            current_note_info = ankiconnect_invoke(None, "notesInfo", notes=[note_id])
-            current_field_content = current_note_info[0]['fields'][field_to_update]['value']
+    Parameters:
+    - df (pd.DataFrame): Cards with 'Note Id', 'Card Type' and 'audio' columns.
+    - last_fields (dict): Card type -> the field to append the audio to.
 
-            # Append audio content to the current content
-            updated_content = current_field_content + audio_content
+    Returns:
+    - dict: 'success_count', the number of rows whose note was updated, and 'errors', a list of
+      (row index, error) for every row whose note couldn't be updated.
+    """
+    error_list = []
 
-            # Prepare note_details for update
-            note_details = {
-                "note": {
-                    "id": note_id,
-                    "fields": {
-                        field_to_update: updated_content
-                    }
-                }
-            }
+    target_rows = df[df['Card Type'].isin(last_fields.keys())]
+    no_audio = target_rows['audio'].isna() | target_rows['audio'].eq('[sound:None]')
+    error_list.extend((index, "Audio could not be synthesized") for index in target_rows.index[no_audio])
+    target_rows = target_rows[~no_audio]
+
+    # Cards of the same note share its fields, so gather the clips per note and field and append each clip once
+    appends = {}
+    rows_by_note = {}
+    for index, note_id, card_type, audio in zip(target_rows.index, target_rows['Note Id'].astype(int), target_rows['Card Type'], target_rows['audio']):
+        clips = appends.setdefault(note_id, {}).setdefault(last_fields[card_type], [])
+        if audio not in clips:
+            clips.append(audio)
+        rows_by_note.setdefault(note_id, []).append(index)
+
+    def fail(note_id, error):
+        error_list.extend((index, error) for index in rows_by_note[note_id])
+
+    # Fetch the current content of every note we're about to update in one batched call
+    current_notes_info = fetch_notes_info(None, list(rows_by_note))
+    if current_notes_info == 1:
+        for note_id in rows_by_note:
+            fail(note_id, "Unable to connect with your Anki profile")
+        return {"success_count": 0, "errors": error_list}
+    notes_by_id = {note['noteId']: note for note in current_notes_info if note}
+
+    # Append the audio to the current content of each field
+    updates = []
+    for note_id, fields in appends.items():
+        note = notes_by_id.get(note_id)
+        if note is None:
+            fail(note_id, "Note not found in Anki")
+            continue
+        missing = [field for field in fields if field not in note['fields']]
+        if missing:
+            fail(note_id, f"Note has no field named {missing[0]}")
+            continue
+        updates.append((note_id, {field: note['fields'][field]['value'] + ''.join(clips) for field, clips in fields.items()}))
+
+    # Write every update back in batched round-trips, keeping track of which notes failed
+    try:
+        envelopes = _multi_envelopes([request('updateNoteFields', note={'id': note_id, 'fields': fields}) for note_id, fields in updates])
+    except requests.exceptions.RequestException:
+        envelopes = [(None, "Unable to connect with your Anki profile")] * len(updates)
 
-            # Make the update call
-            ankiconnect_invoke(None, "updateNoteFields", **note_details)
-            success_count += 1
+    success_count = 0
+    for (note_id, _), (_, error) in zip(updates, envelopes):
+        if error is None:
+            success_count += len(rows_by_note[note_id])
+        else:
+            fail(note_id, error)
 
     return {
         "success_count": success_count,
@@ -254,7 +523,7 @@ def create_ve_card_type():
         ]
     }
     
-    res = ankiconnect_invoke('createModel', **params)
+    res = ankiconnect_invoke(None, 'createModel', **params)
     
     return(res)
     
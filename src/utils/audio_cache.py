@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from utils.database import get_connection
+
+# Synthesized audio is kept in a content-addressed cache folder next to Anki's collection.media,
+# indexed in the app's database so that identical requests never hit the TTS APIs twice.
+AUDIO_CACHE_FOLDER = 'spoonfed_tts_cache'
+
+# Least-recently-used files are evicted once the cache grows past this size
+MAX_AUDIO_CACHE_BYTES = int(os.getenv("SPOONFED_TTS_CACHE_MAX_BYTES", 500 * 1024 * 1024))
+
+def audio_cache_key(provider, voice, model_id, voice_settings, slowdown, text):
+    """Hashes everything that determines what a synthesized clip sounds like."""
+    identity = json.dumps([provider, voice, model_id, voice_settings, slowdown, text], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+def audio_filename(cache_key):
+    """Content-addressed file name, so identical clips share one file in collection.media."""
+    return f"spoonfed-{cache_key[:32]}.mp3"
+
+def _cache_dir(media_dir):
+    cache_dir = os.path.join(os.path.dirname(media_dir), AUDIO_CACHE_FOLDER)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def lookup_cached_audio(cache_key, media_dir):
+    """
+    Returns the file name of a previously synthesized clip, making sure it's present in
+    collection.media, or None if it isn't cached.
+    """
+    filename = audio_filename(cache_key)
+    cached_path = os.path.join(_cache_dir(media_dir), filename)
+    media_path = os.path.join(media_dir, filename)
+
+    conn = get_connection()
+    with conn:
+        row = conn.execute("SELECT filename FROM tts_cache WHERE cache_key=?", (cache_key,)).fetchone()
+        if row is None:
+            return None
+        if not os.path.exists(cached_path):
+            conn.execute("DELETE FROM tts_cache WHERE cache_key=?", (cache_key,))
+            return None
+        conn.execute("UPDATE tts_cache SET last_used_at=? WHERE cache_key=?", (time.time(), cache_key))
+
+    # The clip may have been removed from collection.media (e.g. by 'Check Media'), so restore it
+    if not os.path.exists(media_path):
+        shutil.copyfile(cached_path, media_path)
+    return filename
+
+def store_cached_audio(cache_key, provider, media_dir):
+    """Copies a freshly synthesized clip from collection.media into the cache, then evicts old clips."""
+    filename = audio_filename(cache_key)
+    cached_path = os.path.join(_cache_dir(media_dir), filename)
+    shutil.copyfile(os.path.join(media_dir, filename), cached_path)
+
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO tts_cache (cache_key, filename, provider, size_bytes, created_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (cache_key, filename, provider, os.path.getsize(cached_path), now, now)
+        )
+
+    evict_cached_audio(media_dir)
+
+def evict_cached_audio(media_dir, max_bytes=MAX_AUDIO_CACHE_BYTES):
+    """Deletes least-recently-used clips from the cache folder until it fits in `max_bytes`."""
+    cache_dir = _cache_dir(media_dir)
+    conn = get_connection()
+    with conn:
+        total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM tts_cache").fetchone()[0]
+        if total <= max_bytes:
+            return
+        for cache_key, filename, size_bytes in conn.execute(
+            "SELECT cache_key, filename, size_bytes FROM tts_cache ORDER BY last_used_at"
+        ).fetchall():
+            if total <= max_bytes:
+                break
+            cached_path = os.path.join(cache_dir, filename)
+            if os.path.exists(cached_path):
+                os.remove(cached_path)
+            conn.execute("DELETE FROM tts_cache WHERE cache_key=?", (cache_key,))
+            total -= size_bytes
@@ -3,20 +3,95 @@ import subprocess
 import tempfile
 import requests
 import random
-import string
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import uuid
 import pandas as pd
-
-def generate_audio(df, language, anki_profile_name, tts_api):
+from utils.audio_cache import audio_cache_key, audio_filename, lookup_cached_audio, store_cached_audio
+
+# Per-provider limits for the concurrent audio engine: how many requests may be in flight at once,
+# and how many may be started per second (shared across all worker threads).
+TTS_PROVIDER_LIMITS = {
+    'ElevenLabs': {'max_workers': 4, 'requests_per_second': 2.0},
+    'Narakeet': {'max_workers': 4, 'requests_per_second': 2.0},
+}
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 1.0
+REQUEST_TIMEOUT = 60
+
+class RateLimiter:
+    """Spaces out request start times so that at most `requests_per_second` begin each second, across threads."""
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+_RATE_LIMITERS = {provider: RateLimiter(limits['requests_per_second']) for provider, limits in TTS_PROVIDER_LIMITS.items()}
+
+def _post_with_retry(provider, url, **kwargs):
+    """
+    POSTs to a TTS provider through its rate limiter, retrying 429s, 5xx responses and
+    dropped connections with exponential backoff (or the server's Retry-After, if given).
+    """
+    limiter = _RATE_LIMITERS[provider]
+    kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.wait()
+        try:
+            response = requests.post(url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            logging.warning(f"{provider} request failed ({e}), retrying (attempt {attempt + 1} of {MAX_RETRIES})")
+            time.sleep(BACKOFF_SECONDS * 2 ** attempt)
+            continue
+
+        if response.status_code not in RETRYABLE_STATUS_CODES or attempt == MAX_RETRIES:
+            return response
+
+        retry_after = response.headers.get('Retry-After', '')
+        delay = float(retry_after) if retry_after.isdigit() else BACKOFF_SECONDS * 2 ** attempt
+        logging.warning(f"{provider} returned {response.status_code}, retrying in {delay:.1f}s (attempt {attempt + 1} of {MAX_RETRIES})")
+        time.sleep(delay)
+
+def strip_sentences_for_tts(sentences):
     
     # Strip HTML tags and Anki Cloze notation
-    df['sentence_stripped'] = df['sentence'].str.replace(r'<span class="?[^"]*"?>{{c1::(.*?)::.*?}}</span>', r'\1', regex=True)
-    df['sentence_stripped'] = df['sentence_stripped'].str.replace(r'<[^>]+>', '', regex=True)
+    stripped = sentences.str.replace(r'<span class="?[^"]*"?>{{c1::(.*?)::.*?}}</span>', r'\1', regex=True)
+    stripped = stripped.str.replace(r'<[^>]+>', '', regex=True)
     
     # If the above stripping functions failed then the audio generating functions will include Cloze or HTML nonsense, so stop.
-    if df['sentence_stripped'].str.contains('c1').any():
+    if stripped.str.contains('c1').any():
         raise ValueError("The HTML or Anki Cloze structure returned by the language model is incorrect, so generated audio would be incorrect.")
 
+    return stripped
+
+def get_synthesizer(language, anki_profile_name, tts_api):
+    """Returns a function that synthesizes one sentence with the chosen TTS API, returning the file name or None."""
+    if tts_api == "ElevenLabs":
+        return lambda x: call_elevenlabs_api(x, language, anki_profile_name)
+    elif tts_api == "Narakeet":
+        return lambda x: call_narakeet_api(x, get_voice(x), language, anki_profile_name)
+    else:
+        raise ValueError("Invalid TTS API selected. Choose 'ElevenLabs' or 'Narakeet'.")
+
+def generate_audio(df, language, anki_profile_name, tts_api):
+    
+    df['sentence_stripped'] = strip_sentences_for_tts(df['sentence'])
+
     pd.set_option("display.max_rows", 1000)
     pd.set_option("display.expand_frame_repr", True)
     pd.set_option('display.width', 1000)
@@ -24,13 +99,11 @@ def generate_audio(df, language, anki_profile_name, tts_api):
     
     # Generate an audio file for each row of the 'sentence' column,
     # and return a new column to the dataset with the audio file names. 
+    synthesize = get_synthesizer(language, anki_profile_name, tts_api)
 
-    if tts_api == "ElevenLabs":
-        df['audio'] = df['sentence_stripped'].apply(lambda x: call_elevenlabs_api(x, language, anki_profile_name))
-    elif tts_api == "Narakeet":
-        df['audio'] = df['sentence_stripped'].apply(lambda x: call_narakeet_api(x, get_voice(), language, anki_profile_name))
-    else:
-        raise ValueError("Invalid TTS API selected. Choose 'ElevenLabs' or 'Narakeet'.")
+    # Synthesize the rows concurrently. executor.map hands the results back in row order.
+    with ThreadPoolExecutor(max_workers=TTS_PROVIDER_LIMITS[tts_api]['max_workers']) as executor:
+        df['audio'] = list(executor.map(synthesize, df['sentence_stripped']))
 
     
     # Format the values in the audio column so that Anki will actually play them
@@ -38,10 +111,55 @@ def generate_audio(df, language, anki_profile_name, tts_api):
     
     return df
 
-# Randomly choose a Hindi voice from all available on Narakeet
-def get_voice():
+def iter_generated_audio(sentences, language, anki_profile_name, tts_api):
+    """
+    Synthesizes audio for each sentence concurrently, like generate_audio, but hands every clip
+    over as soon as it lands rather than waiting for the whole batch.
+
+    Parameters:
+    - sentences (pd.Series): The sentences to voice, possibly with HTML and Cloze markup.
+    - language (str): The language of the sentences.
+    - anki_profile_name (str): The Anki profile whose collection.media the clips are saved to.
+    - tts_api (str): 'ElevenLabs' or 'Narakeet'.
+
+    Yields:
+    - tuple: (index of the sentence, '[sound:...]' field value, or None if synthesis failed), in completion order.
+    """
+    stripped = strip_sentences_for_tts(sentences)
+    synthesize = get_synthesizer(language, anki_profile_name, tts_api)
+
+    executor = ThreadPoolExecutor(max_workers=TTS_PROVIDER_LIMITS[tts_api]['max_workers'])
+    try:
+        futures = {executor.submit(synthesize, text): index for index, text in stripped.items()}
+        for future in as_completed(futures):
+            filename = future.result()
+            yield futures[future], f"[sound:{filename}]" if filename else None
+    finally:
+        # Don't start synthesizing clips nobody will collect if the consumer stops early
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Randomly choose a Hindi voice from all available on Narakeet.
+# Seeding on the text keeps the choice stable for a given sentence, so its audio can be reused from the cache.
+def get_voice(text=None):
     all_hindi_voices = ['preeti', 'mehar', 'nitesh', 'sushma', 'amitabh', 'kareena', 'aditi']
-    return random.choice(all_hindi_voices)
+    return random.Random(text).choice(all_hindi_voices)
+
+def save_audio_file(audio_data, directory_path, filename, slowdown=None):
+    """
+    Writes a clip into collection.media, optionally slowing it down first. The file is written under a
+    temporary name and moved into place, so concurrent writers of the same clip never see a partial file.
+    """
+    save_path = os.path.join(directory_path, filename)
+    tmp_path = f"{save_path}.{uuid.uuid4().hex}.part.mp3"
+
+    with open(tmp_path, 'wb') as f:
+        f.write(audio_data)
+
+    # Slow down the audio using ffmpeg
+    if slowdown and slowdown != 1.0:
+        slow_down_audio(tmp_path, factor=slowdown)
+
+    os.replace(tmp_path, save_path)
 
 # Get the filepath for the folder where Anki media files need to be stored
 def get_anki_media_path(anki_profile_name):
@@ -59,6 +177,15 @@ def call_narakeet_api(text, voice, language, anki_profile_name):
         return None
 
     try:
+        # Get the save path from get_anki_media_path()
+        directory_path = get_anki_media_path(anki_profile_name)
+
+        # Reuse the audio if this exact sentence was already rendered with the same voice
+        cache_key = audio_cache_key("Narakeet", voice, None, {"language": language, "voice-speed": .8}, None, text)
+        cached = lookup_cached_audio(cache_key, directory_path)
+        if cached:
+            return cached
+
         # Define the endpoint and parameters for the API call
         url = f'https://api.narakeet.com/text-to-speech/mp3?voice={voice}&language={language}&voice-speed=.8'
 
@@ -73,7 +200,7 @@ def call_narakeet_api(text, voice, language, anki_profile_name):
 
         logging.info(f"Sending request to Narakeet for text: {text[:50]}...")  # Display only the first 50 characters of the text for brevity
 
-        response = requests.post(url, **options)
+        response = _post_with_retry('Narakeet', url, **options)
 
         # Check the response status code
         if response.status_code != 200:
@@ -83,23 +210,10 @@ def call_narakeet_api(text, voice, language, anki_profile_name):
         # Make the API call to get audio data
         audio_data = response.content
 
-        # Get the save path from get_anki_media_path()
-        directory_path = get_anki_media_path(anki_profile_name)
-
-        # Use the first 10 characters of the text for the filename,
-        # unless the text field is empty, in which case just use a random string
-        if text:
-            filename = f"{text[:10]}-{random.randint(10000000, 99999999)}.mp3"
-        else:
-            random_string = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
-            filename = f"{random_string}.mp3"
-
-        # Join them to get the full save path
-        save_path = os.path.join(directory_path, filename)  
-
-        # Save the audio data to the specified path
-        with open(save_path, 'wb') as f:
-            f.write(audio_data)
+        # Name the file after its cache key and save it
+        filename = audio_filename(cache_key)
+        save_audio_file(audio_data, directory_path, filename)
+        store_cached_audio(cache_key, "Narakeet", directory_path)
 
         # Return the filename
         return filename
@@ -138,24 +252,38 @@ def call_elevenlabs_api(text, language, anki_profile_name, slowdown=0.75):
             
         url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice}"
 
+        # Vary the delivery between sentences, but seed on the text so a given sentence always gets the same settings
+        rng = random.Random(text)
+
         # Build the payload
         payload = {
             "text": text,
             "model_id": "eleven_multilingual_v2",
             "voice_settings": {
-                "stability": random.randint(30, 80)/100,  # Random integer stability between 50 and 70
-                "similarity_boost": random.randint(30, 80)/100,  # Random integer similarity boost between 60 and 80
+                "stability": rng.randint(30, 80)/100,  # Random integer stability between 50 and 70
+                "similarity_boost": rng.randint(30, 80)/100,  # Random integer similarity boost between 60 and 80
                 "use_speaker_boost": True
             }
             
         }
+
+        # Get the save path from
+        directory_path = get_anki_media_path(anki_profile_name)
+
+        # Reuse the audio if this exact sentence was already rendered with the same voice and settings
+        # (French is additionally re-voiced through speech-to-speech, so that's part of the key too)
+        model_id = payload["model_id"] + ("+eleven_multilingual_sts_v2" if language == "French" else "")
+        cache_key = audio_cache_key("ElevenLabs", voice, model_id, payload["voice_settings"], slowdown, text)
+        cached = lookup_cached_audio(cache_key, directory_path)
+        if cached:
+            return cached
         headers = {
             "Accept": "audio/mpeg",
             "xi-api-key": os.getenv("ELEVENLABS_API_KEY"),
             "Content-Type": "application/json",
         }
     
-        response = requests.request("POST", url, json=payload, headers=headers)
+        response = _post_with_retry('ElevenLabs', url, json=payload, headers=headers)
 
         # Check the response status code
         if response.status_code != 200:
@@ -181,37 +309,26 @@ def call_elevenlabs_api(text, language, anki_profile_name, slowdown=0.75):
                 "xi-api-key": os.getenv("ELEVENLABS_API_KEY"),
             }
 
-            response = requests.post(
+            response = _post_with_retry(
+                'ElevenLabs',
                 url,
                 files=files,
                 headers=headers,
             )
             
+            # Check the response status code
+            if response.status_code != 200:
+                logging.error(f"Failed to convert audio for text: {text[:50]}. Error: {response.text}")
+                return None
+
             # Extract the Alex version of the French text
             audio_data = response.content
             
 
-        # Get the save path from
-        directory_path = get_anki_media_path(anki_profile_name)
-
-        # Use the first 10 characters of the text for the filename,
-        # unless the text field is empty, in which case just use a random string
-        if text:
-            filename = f"{text[:10]}-{random.randint(10000000, 99999999)}.mp3"
-        else:
-            random_string = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
-            filename = f"{random_string}.mp3"
-
-        # Join them to get the full save path
-        save_path = os.path.join(directory_path, filename)
-
-        # Save the audio data to the specified path
-        with open(save_path, 'wb') as f:
-            f.write(audio_data)
-
-        # Slow down the audio using ffmpeg
-        if slowdown and slowdown != 1.0:
-            slow_down_audio(save_path, factor=slowdown)
+        # Name the file after its cache key, then save and slow it down
+        filename = audio_filename(cache_key)
+        save_audio_file(audio_data, directory_path, filename, slowdown=slowdown)
+        store_cached_audio(cache_key, "ElevenLabs", directory_path)
 
         # Return the filename
         return filename
@@ -0,0 +1,186 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+# The app's single SQLite database. It lives in the repo root whatever directory the app is started from,
+# unless SPOONFED_DATABASE points somewhere else.
+DATABASE_PATH = Path(os.getenv("SPOONFED_DATABASE", Path(__file__).resolve().parent.parent.parent / "database.db"))
+
+_local = threading.local()
+_migrate_lock = threading.Lock()
+_migrated = False
+
+def _add_column(conn, table, column, column_type):
+    # Older databases may already have the column, e.g. if it was added before migrations existed
+    if column not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+def _create_core_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS users
+                    (id INTEGER PRIMARY KEY, profile_name TEXT UNIQUE)''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS language_configurations (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            configuration_name TEXT,
+            configuration_language TEXT,
+            learned_deck TEXT,
+            new_deck TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS card_types (
+            card_type_id INTEGER PRIMARY KEY,
+            configuration_id INTEGER,
+            card_type_name TEXT,
+            FOREIGN KEY(configuration_id) REFERENCES language_configurations(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS card_fields (
+            field_id INTEGER PRIMARY KEY,
+            card_type_id INTEGER,
+            field_name TEXT,
+            FOREIGN KEY(card_type_id) REFERENCES card_types(card_type_id)
+        )
+    ''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS runs
+                    (run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     timestamp TEXT NOT NULL,
+                     gpt_model TEXT,
+                     audio_provider TEXT,
+                     language_configuration_id INTEGER,
+                     FOREIGN KEY(language_configuration_id) REFERENCES language_configurations(id))''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS gpt_responses
+                    (run_id INTEGER,
+                     n_sentences INTEGER,
+                     sentence_order INTEGER,
+                     sentence TEXT,
+                     translation TEXT,
+                     new_word TEXT,
+                     n_words INTEGER,
+                     n_known_words INTEGER,
+                     n_new_words INTEGER,
+                     n_rogue_words INTEGER,
+                     filter_condition TEXT,
+                     meets_criteria BOOLEAN,
+                     FOREIGN KEY(run_id) REFERENCES runs(run_id))''')
+
+def _add_run_ledger_columns(conn):
+    _add_column(conn, 'runs', 'latency_seconds', 'REAL')
+    _add_column(conn, 'runs', 'prompt_chars', 'INTEGER')
+    _add_column(conn, 'runs', 'n_prompts', 'INTEGER')
+    _add_column(conn, 'runs', 'acceptance_rate', 'REAL')
+
+def _create_cache_tables(conn):
+    # Claude CLI responses (see generation_cache.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS generation_cache (
+            model TEXT,
+            prompt_hash TEXT,
+            response TEXT,
+            created_at REAL,
+            PRIMARY KEY (model, prompt_hash)
+        )
+    ''')
+
+    # Daily hit/miss counters for the usage dashboards
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS generation_cache_stats (
+            day TEXT,
+            model TEXT,
+            hits INTEGER DEFAULT 0,
+            misses INTEGER DEFAULT 0,
+            PRIMARY KEY (day, model)
+        )
+    ''')
+
+    # Synthesized audio (see audio_cache.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tts_cache (
+            cache_key TEXT PRIMARY KEY,
+            filename TEXT,
+            provider TEXT,
+            size_bytes INTEGER,
+            created_at REAL,
+            last_used_at REAL
+        )
+    ''')
+
+    # Per-note tokens and audio flags (see token_cache.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS note_tokens (
+            field_signature TEXT,
+            note_id INTEGER,
+            mod INTEGER,
+            tokens TEXT,
+            PRIMARY KEY (field_signature, note_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS note_audio_flags (
+            field_signature TEXT,
+            note_id INTEGER,
+            mod INTEGER,
+            has_audio INTEGER,
+            PRIMARY KEY (field_signature, note_id)
+        )
+    ''')
+
+def _create_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_language_configurations_user_name ON language_configurations (user_id, configuration_name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_card_types_configuration ON card_types (configuration_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_card_fields_card_type ON card_fields (card_type_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_gpt_responses_run ON gpt_responses (run_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tts_cache_last_used ON tts_cache (last_used_at)")
+
+# Schema migrations, applied in order. The database's PRAGMA user_version records how many have run,
+# so append new steps to the end and never edit one that has shipped.
+MIGRATIONS = [
+    _create_core_tables,
+    _add_run_ledger_columns,
+    _create_cache_tables,
+    _create_indexes,
+]
+
+def migrate(conn):
+    """Applies any migrations the database hasn't had yet, each in its own transaction."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            # DDL doesn't open a transaction implicitly, so start one to keep each step all-or-nothing
+            conn.execute("BEGIN")
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+
+def get_connection():
+    """
+    Returns this thread's connection to the app's database, opening it (and bringing the schema up to date)
+    on first use. Connections are kept open for the life of the thread, so don't close them; wrap writes
+    in `with conn:` to commit them as one transaction.
+    """
+    global _migrated
+
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+
+        # WAL lets readers, e.g. the UI thread, carry on while a worker thread is writing
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+        with _migrate_lock:
+            if not _migrated:
+                migrate(conn)
+                _migrated = True
+        _local.conn = conn
+    return conn
+
+def close_connection():
+    """Closes this thread's connection, if it has one. The next get_connection() opens a new one."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
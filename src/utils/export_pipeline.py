@@ -0,0 +1,71 @@
+import time
+import pandas as pd
+from utils.anki_connect_functions import add_notes
+
+# Ready notes are sent to Anki in batches of this many, or sooner once the oldest one has waited this long
+EXPORT_BATCH_SIZE = 25
+EXPORT_BATCH_SECONDS = 2.0
+
+def export_notes(rows, make_note, audio_clips=None, on_progress=None):
+    """
+    Creates one Anki note per row, adding each note as soon as its audio is ready. While a batch is being
+    added, the TTS threads behind `audio_clips` keep synthesizing, so the export takes about as long as
+    the slower of the two rather than their sum. Run it off the UI thread.
+
+    Parameters:
+    - rows (pd.DataFrame): The rows to export.
+    - make_note (callable): Builds the note dict for a row (see build_note). The row's 'audio' is set first.
+    - audio_clips (iterator): Optional. Yields (row index, audio field value or None) as each clip lands,
+      e.g. from iter_generated_audio. If omitted, the notes are exported without audio.
+    - on_progress (callable): Optional. Called as on_progress(n_done, n_total) after every batch.
+
+    Returns:
+    - pd.DataFrame: One result per row, indexed like `rows`, as reported by add_notes: 'status'
+      ('added', 'duplicate' or 'failed'), 'note_id' and 'error'.
+    """
+    if audio_clips is None:
+        audio_clips = ((index, ' ') for index in rows.index)
+
+    results = {}
+    pending = []
+    oldest = None
+
+    def report():
+        if on_progress is not None:
+            on_progress(len(results), len(rows))
+
+    def fail(index, error):
+        results[index] = {'status': 'failed', 'note_id': None, 'error': error}
+
+    def flush():
+        batch = pending[:]
+        pending.clear()
+        try:
+            note_results = add_notes([note for _, note in batch])
+        except Exception as e:
+            note_results = [{'status': 'failed', 'note_id': None, 'error': str(e)}] * len(batch)
+
+        for (index, _), result in zip(batch, note_results):
+            results[index] = result
+        report()
+
+    for index, audio in audio_clips:
+        if audio is None:
+            fail(index, "Audio could not be synthesized")
+            report()
+            continue
+
+        row = rows.loc[index].copy()
+        row['audio'] = audio
+        pending.append((index, make_note(row)))
+        if oldest is None:
+            oldest = time.monotonic()
+
+        if len(pending) >= EXPORT_BATCH_SIZE or time.monotonic() - oldest >= EXPORT_BATCH_SECONDS:
+            flush()
+            oldest = None
+
+    if pending:
+        flush()
+
+    return pd.DataFrame.from_dict(results, orient='index', columns=['status', 'note_id', 'error']).reindex(rows.index)
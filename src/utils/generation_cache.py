@@ -0,0 +1,42 @@
+import hashlib
+import os
+import time
+from datetime import date
+from utils.database import get_connection
+
+# Opt-in cache of Claude CLI responses, keyed by model and a hash of the fully rendered prompt.
+# Enable it by setting SPOONFED_GENERATION_CACHE=1 in your .env file.
+GENERATION_CACHE_ENABLED = os.getenv("SPOONFED_GENERATION_CACHE", "0") == "1"
+GENERATION_CACHE_TTL_SECONDS = int(os.getenv("SPOONFED_GENERATION_CACHE_TTL", 7 * 24 * 60 * 60))
+
+def prompt_hash(full_prompt):
+    return hashlib.sha256(full_prompt.encode('utf-8')).hexdigest()
+
+def get_cached_generation(model, full_prompt, ttl=GENERATION_CACHE_TTL_SECONDS):
+    """
+    Returns the stored response for this exact prompt and model if it's younger than `ttl` seconds,
+    otherwise None. Either way the lookup is counted as a hit or a miss.
+    """
+    conn = get_connection()
+    with conn:
+        row = conn.execute(
+            "SELECT response FROM generation_cache WHERE model=? AND prompt_hash=? AND created_at>=?",
+            (model, prompt_hash(full_prompt), time.time() - ttl)
+        ).fetchone()
+
+        counter = 'hits' if row else 'misses'
+        conn.execute("INSERT OR IGNORE INTO generation_cache_stats (day, model) VALUES (?, ?)", (date.today().isoformat(), model))
+        conn.execute(f"UPDATE generation_cache_stats SET {counter} = {counter} + 1 WHERE day=? AND model=?", (date.today().isoformat(), model))
+
+    return row[0] if row else None
+
+def store_generation(model, full_prompt, response):
+    """Saves a response, replacing any older one for the same prompt, and drops expired entries."""
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO generation_cache (model, prompt_hash, response, created_at) VALUES (?, ?, ?, ?)",
+            (model, prompt_hash(full_prompt), response, now)
+        )
+        conn.execute("DELETE FROM generation_cache WHERE created_at<?", (now - GENERATION_CACHE_TTL_SECONDS,))
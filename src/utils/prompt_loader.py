@@ -1,9 +1,115 @@
+import os
+import re
+import string
+import threading
 import yaml
 from pathlib import Path
 
 PROMPTS_DIR = Path(__file__).resolve().parent.parent.parent / "prompts"
 
 
+class PromptTemplate:
+    """
+    A prompt template with its language overrides merged in, ready to render.
+    Every placeholder is checked when the template is loaded: it must either have a default
+    in the YAML or be listed under the prompt's `runtime_vars`.
+    """
+
+    def __init__(self, name, template, defaults, runtime_vars, sources):
+        self.name = name
+        self.template = template
+        self.defaults = defaults
+        self.runtime_vars = runtime_vars
+        self.sources = sources
+
+        placeholders = {
+            re.split(r'[.\[]', field)[0]
+            for _, field, _, _ in string.Formatter().parse(template)
+            if field
+        }
+        undeclared = sorted(placeholders - set(defaults) - set(runtime_vars))
+        if undeclared:
+            raise ValueError(
+                f"Prompt '{name}' uses undeclared placeholders: {', '.join(undeclared)}. "
+                "Give them a default or list them under runtime_vars."
+            )
+
+    def is_stale(self):
+        """True if any of the YAML files this template was merged from has changed or appeared since."""
+        return any(_mtime(path) != mtime for path, mtime in self.sources.items())
+
+    def render(self, **template_vars):
+        # Runtime template_vars take precedence over YAML keys
+        missing = [var for var in self.runtime_vars if var not in template_vars]
+        if missing:
+            raise ValueError(f"Prompt '{self.name}' is missing template variables: {', '.join(missing)}")
+        return self.template.format(**{**self.defaults, **template_vars})
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _read_yaml(path):
+    with open(path, encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+class PromptRegistry:
+    """
+    Loads and merges every prompt under `prompts/` once, caching the merged templates by
+    (prompt_name, language). Entries are reloaded when their files change, so prompts can be edited live.
+    """
+
+    def __init__(self, prompts_dir=PROMPTS_DIR):
+        self.prompts_dir = Path(prompts_dir)
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def load_all(self):
+        """Loads every prompt and language override, so that a broken template fails straight away."""
+        for prompt_dir in sorted(self.prompts_dir.iterdir()):
+            if not (prompt_dir / "base.yaml").exists():
+                continue
+            self.get(prompt_dir.name, None)
+            for override in sorted(prompt_dir.glob("*.yaml")):
+                if override.name != "base.yaml":
+                    self.get(prompt_dir.name, override.stem)
+
+    def get(self, prompt_name, language):
+        key = (prompt_name, language.lower() if language else None)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None or template.is_stale():
+                template = self._load(*key)
+                self._templates[key] = template
+            return template
+
+    def _load(self, prompt_name, language):
+        prompt_dir = self.prompts_dir / prompt_name
+        base_path = prompt_dir / "base.yaml"
+        lang_path = prompt_dir / f"{language}.yaml" if language else None
+
+        # Record the override's mtime even if it doesn't exist, so that creating it invalidates the entry
+        sources = {base_path: _mtime(base_path)}
+        if lang_path is not None:
+            sources[lang_path] = _mtime(lang_path)
+
+        # Merge: language overrides win over base defaults
+        merged = {**_read_yaml(base_path), **(_read_yaml(lang_path) if lang_path is not None and lang_path.exists() else {})}
+        prompt_template = merged.pop("prompt")
+        runtime_vars = merged.pop("runtime_vars", [])
+        return PromptTemplate(prompt_name, prompt_template, merged, runtime_vars, sources)
+
+
+_registry = PromptRegistry()
+_system_prompt = {"mtime": None, "prompt": None}
+_system_prompt_lock = threading.Lock()
+
+
 def load_prompt(prompt_name, override_language, **template_vars):
     """
     Load a prompt by name, merge language-specific overrides, fill template vars.
@@ -12,30 +118,20 @@ def load_prompt(prompt_name, override_language, **template_vars):
     override_language: e.g. "Hindi", "Turkish" — selects which override file to load
     **template_vars: runtime values like language, verb_input, learned_tokens, etc.
     """
-    prompt_dir = PROMPTS_DIR / prompt_name
-
-    # Load base
-    with open(prompt_dir / "base.yaml") as f:
-        base = yaml.safe_load(f)
-
-    # Load language override if it exists
-    lang_file = prompt_dir / f"{override_language.lower()}.yaml"
-    overrides = {}
-    if lang_file.exists():
-        with open(lang_file) as f:
-            overrides = yaml.safe_load(f) or {}
+    return _registry.get(prompt_name, override_language).render(**template_vars)
 
-    # Merge: language overrides win over base defaults
-    merged = {**base, **overrides}
 
-    # Extract the prompt template, fill section variables then runtime vars
-    # Runtime template_vars take precedence over YAML keys
-    prompt_template = merged.pop("prompt")
-    all_vars = {**merged, **template_vars}
-    return prompt_template.format(**all_vars)
+def validate_prompts():
+    """Loads every prompt under prompts/, raising ValueError if any template is broken."""
+    _registry.load_all()
 
 
 def load_system_prompt():
-    with open(PROMPTS_DIR / "system.yaml") as f:
-        data = yaml.safe_load(f)
-    return data["prompt"]
+    # Cached until system.yaml changes on disk
+    path = PROMPTS_DIR / "system.yaml"
+    mtime = _mtime(path)
+    with _system_prompt_lock:
+        if _system_prompt["prompt"] is None or _system_prompt["mtime"] != mtime:
+            _system_prompt["prompt"] = _read_yaml(path)["prompt"]
+            _system_prompt["mtime"] = mtime
+        return _system_prompt["prompt"]
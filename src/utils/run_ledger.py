@@ -0,0 +1,107 @@
+import queue
+import sqlite3
+import threading
+import pandas as pd
+from datetime import datetime
+from utils.database import get_connection, close_connection
+
+# Every generation run is recorded in the app's database: one row in `runs`, plus one row per
+# generated sentence in `gpt_responses`. Writes happen on a background thread, so recording a
+# run never blocks the UI or the generation worker. The schema lives in database.py.
+
+# The gpt_responses columns written for each sentence. Anything else in the generated
+# DataFrame (e.g. the 'unknown_words' lists) stays out of the database.
+SENTENCE_COLUMNS = [
+    'sentence', 'translation', 'new_word', 'n_words', 'n_known_words',
+    'n_new_words', 'n_rogue_words', 'meets_criteria',
+]
+
+_queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+def _to_sql_value(value):
+    # numpy scalars and missing values don't bind as SQLite parameters
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+def _write_run(conn, run):
+    with conn:
+        c = conn.execute(
+            '''INSERT INTO runs (timestamp, gpt_model, audio_provider, language_configuration_id,
+                                 latency_seconds, prompt_chars, n_prompts, acceptance_rate)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            (run['timestamp'], run['gpt_model'], run['audio_provider'], run['configuration_id'],
+             run['latency_seconds'], run['prompt_chars'], run['n_prompts'], run['acceptance_rate'])
+        )
+        run_id = c.lastrowid
+        conn.executemany(
+            f'''INSERT INTO gpt_responses (run_id, n_sentences, sentence_order, filter_condition, {', '.join(SENTENCE_COLUMNS)})
+                VALUES ({', '.join('?' * (4 + len(SENTENCE_COLUMNS)))})''',
+            [(run_id, len(run['rows']), order, run['selection_criterion'], *row) for order, row in enumerate(run['rows'])]
+        )
+
+def _write_runs():
+    while True:
+        run = _queue.get()
+        try:
+            if run is None:
+                close_connection()
+                return
+            _write_run(get_connection(), run)
+        except sqlite3.Error as e:
+            print(f"Database error in the run ledger: {e}")
+        finally:
+            _queue.task_done()
+
+def record_run(sentences, gpt_model, selection_criterion, latency_seconds, prompts,
+               audio_provider=None, configuration_id=None):
+    """
+    Queues a generation run to be written to the ledger, and returns straight away.
+
+    Parameters:
+    - sentences (pd.DataFrame): The scored and flagged sentences the run produced.
+    - gpt_model (str): The model the sentences were generated with.
+    - selection_criterion (str): The rule the sentences were flagged against, e.g. 'i+1 no rogue'.
+    - latency_seconds (float): How long generating and scoring the sentences took.
+    - prompts (list): The prompts that were sent.
+    - audio_provider (str): Optional. The TTS provider chosen when the run was started.
+    - configuration_id (int): Optional. The id of the language configuration in use.
+    """
+    global _writer
+
+    # Copy the values out now, so the worker thread never shares the DataFrame with the UI
+    rows = [
+        tuple(_to_sql_value(value) for value in row)
+        for row in sentences.reindex(columns=SENTENCE_COLUMNS).itertuples(index=False, name=None)
+    ]
+    acceptance_rate = float(sentences['meets_criteria'].mean()) if 'meets_criteria' in sentences and len(sentences) else None
+
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_write_runs, name='run-ledger', daemon=True)
+            _writer.start()
+
+    _queue.put({
+        'timestamp': datetime.now().isoformat(),
+        'gpt_model': gpt_model,
+        'audio_provider': audio_provider,
+        'configuration_id': configuration_id,
+        'latency_seconds': latency_seconds,
+        'prompt_chars': sum(len(prompt) for prompt in prompts),
+        'n_prompts': len(prompts),
+        'acceptance_rate': acceptance_rate,
+        'selection_criterion': selection_criterion,
+        'rows': rows,
+    })
+
+def close_run_ledger(timeout=5):
+    """Waits (up to `timeout` seconds) for queued runs to be written, then stops the writer thread."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            return
+        _queue.put(None)
+        _writer.join(timeout)
+        _writer = None
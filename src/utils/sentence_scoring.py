@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from utils.tokenizers import get_tokenizer
+
+class SentenceScorer:
+    """
+    Counts the known, new and rogue words of sentences against a deck's vocabulary.
+    Built once per deck load, so the vocabulary is indexed a single time rather than on every evaluation.
+    """
+    def __init__(self, known_vocab, new_vocab, language):
+        self.known_vocab = frozenset(known_vocab.dropna())
+        self.new_vocab = frozenset(new_vocab.dropna())
+        self.tokenizer = get_tokenizer(language)
+
+        # Arrays are what pandas' isin hashes fastest
+        self._known_array = np.array(list(self.known_vocab), dtype=object)
+        self._new_array = np.array(list(self.new_vocab), dtype=object)
+
+    def score(self, sentences):
+        """
+        Scores a whole batch of sentences in one pass.
+
+        Parameters:
+        - sentences (iterable): The sentences to score. Markup and punctuation are stripped by the
+          language's tokenizer, so punctuation-attached words still match the vocabulary.
+
+        Returns:
+        - dict: Columnar results, one entry per sentence: 'n_words', 'n_known_words', 'n_new_words'
+          and 'n_rogue_words' as integer arrays, and 'unknown_words' (the distinct words that aren't
+          in the learned vocabulary) as a list of lists.
+        """
+        sentences = pd.Series(list(sentences), dtype=object)
+        n_sentences = len(sentences)
+
+        # One long (sentence position, token) table for the whole batch
+        tokens = self.tokenizer.tokenize_series(sentences)
+        n_words = np.bincount(tokens.index.to_numpy(dtype=np.int64), minlength=n_sentences)
+
+        # Word types are counted over each sentence's distinct words
+        pairs = pd.DataFrame({'position': tokens.index.to_numpy(dtype=np.int64), 'token': tokens.to_numpy()}).drop_duplicates()
+        positions = pairs['position'].to_numpy()
+        is_known = pairs['token'].isin(self._known_array).to_numpy()
+
+        n_unique = np.bincount(positions, minlength=n_sentences)
+        n_known_words = np.bincount(positions[is_known], minlength=n_sentences)
+
+        if self.new_vocab:
+            # New deck has tokens: distinguish new vs rogue
+            is_new = pairs['token'].isin(self._new_array).to_numpy()
+            n_new_words = np.bincount(positions[is_new], minlength=n_sentences)
+            n_rogue_words = n_unique - n_known_words - n_new_words
+        else:
+            # No new deck: all non-known words are "new" (Claude chose them)
+            n_new_words = n_unique - n_known_words
+            n_rogue_words = np.zeros(n_sentences, dtype=np.int64)
+
+        unknown_words = [[] for _ in range(n_sentences)]
+        for position, token in zip(positions[~is_known], pairs['token'].to_numpy()[~is_known]):
+            unknown_words[position].append(token)
+
+        return {
+            'n_words': n_words,
+            'n_known_words': n_known_words,
+            'n_new_words': n_new_words,
+            'n_rogue_words': n_rogue_words,
+            'unknown_words': unknown_words,
+        }
@@ -4,36 +4,314 @@ import subprocess
 import json
 import re as _re
 import pandas as pd
-import sqlite3
 import csv
-from datetime import datetime
+import threading
+import time
+import math
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 from utils.prompt_loader import load_system_prompt
+from utils.generation_cache import get_cached_generation, store_generation
+from utils.run_ledger import record_run
 
-def generate_text(calling_frame):
+# Upper bound on the number of Claude CLI processes a sharded generation runs at once
+MAX_CONCURRENT_CLI_CALLS = int(os.getenv("SPOONFED_MAX_CLI_PROCESSES", 4))
 
-    # Get all the user specifications from the calling frame, or from 'global' state
-    learned_deck_tokens = calling_frame.controller.learned_deck_tokens
-    new_deck_tokens = calling_frame.controller.new_deck_tokens
+# Budget for generate_until_quota: at most this many generation rounds per click, and this many forbidden words per prompt
+MAX_GENERATION_ROUNDS = int(os.getenv("SPOONFED_MAX_GENERATION_ROUNDS", 3))
+MAX_FORBIDDEN_WORDS = 50
+
+def select_prompt_vocab(learned_tokens, budget, new_words=None, context_notes=None):
+    """
+    Picks at most `budget` learned words to put in a prompt, so prompt size stays flat as the deck grows.
+
+    Parameters:
+    - learned_tokens (pd.Series): Unique learned words, most frequent first (as loaded by load_vocab_from_deck).
+    - budget (int): The maximum number of words to select, or None for no limit.
+    - new_words (iterable): Optional. The new words the prompt will ask for.
+    - context_notes (list): Optional. Token lists of notes, e.g. from the new deck. Learned words that
+      share a note with one of `new_words` are picked first, since they're its most natural context.
+
+    Returns:
+    - pd.Series: The selected words; co-occurring words first, then by frequency.
+    """
+    if budget is None or len(learned_tokens) <= budget:
+        return learned_tokens
+
+    co_occurring = []
+    if new_words is not None and context_notes:
+        new_word_set = set(new_words)
+        learned_set = set(learned_tokens)
+        counts = Counter()
+        for tokens in context_notes:
+            if not new_word_set.isdisjoint(tokens):
+                counts.update(token for token in set(tokens) if token in learned_set)
+        co_occurring = [token for token, _ in counts.most_common(budget)]
+
+    selected = list(dict.fromkeys(co_occurring + learned_tokens.iloc[:budget].tolist()))[:budget]
+    return pd.Series(selected, dtype=str)
+
+class GenerationCancelled(Exception):
+    """Raised inside a generation job when the user cancels it."""
+
+def generate_text(request, cancel_event=None, on_rows=None):
+    """
+    Generates and evaluates sentences. This is safe to call off the UI thread: everything it needs
+    from the calling frame is passed in `request` (see GeneratingFrameQt.generation_request).
+
+    Parameters:
+    - request (dict): The prompt, model, selection criterion and the deck's SentenceScorer for this run.
+      If it has a 'prompts' list, each prompt is sent as a concurrent shard and the results are merged.
+      'use_cache' and 'bypass_cache' control the generation cache (see _call_claude_cli).
+    - cancel_event (threading.Event): Optional. Setting it kills the in-flight CLI call.
+    - on_rows (callable): Optional. Streams the output: called with a scored and flagged
+      DataFrame of the new rows each time complete CSV rows arrive from the CLI.
+
+    Returns:
+    - pd.DataFrame: The generated sentences with their word counts and 'meets_criteria' flag.
+    """
+
+    # Get all the user specifications captured from the calling frame
+    scorer = request['scorer']
+
+    # Score and flag streamed rows as they arrive, the same way the full batch is scored below
+    def score_streamed_rows(rows):
+        partial = pd.DataFrame(rows)
+        if 'sentence' not in partial.columns:
+            return
+        partial = score_sentences(partial, scorer)
+        on_rows(flag_bad_sentences(partial, request['selection_criterion']))
+
+    on_csv_rows = score_streamed_rows if on_rows is not None else None
     
     # Generate sentences
-    gpt_payload = _call_claude_cli(calling_frame.prompt, calling_frame.model_picklist.currentText())
+    prompts = request.get('prompts', [request['prompt']])
+    started = time.perf_counter()
+    gpt_payload = _call_claude_cli_sharded(
+        prompts,
+        request['model'],
+        cancel_event,
+        use_cache=request.get('use_cache', False),
+        bypass_cache=request.get('bypass_cache', False),
+        on_rows=on_csv_rows,
+    )
+
+    # Export for debugging purposes
+    with open('test-payload.csv', 'w', encoding='utf-8') as f:
+        f.write(gpt_payload[0])
     
     # Quality control and examine the generated sentences
-    gpt_payload_enhanced = evaluate_gpt_response(gpt_payload, learned_deck_tokens, new_deck_tokens)
+    gpt_payload_enhanced = evaluate_gpt_response(gpt_payload, scorer)
     
     # Flag sentences that don't meet the specified rule, e.g. 'i+1 no rogue'
-    gpt_payload_enhanced = flag_bad_sentences(gpt_payload_enhanced, calling_frame.selection_criterion_picklist.currentText())
+    gpt_payload_enhanced = flag_bad_sentences(gpt_payload_enhanced, request['selection_criterion'])
     
     # Export for debugging 
     gpt_payload_enhanced.to_csv('test-payload-enhanced.csv', encoding='utf-8', index=False)
 
-    # Apend to the database
-  #  save_to_database("database.db", gpt_payload_enhanced, calling_frame.model_picklist.currentText(), audio_source) 
-    
+    # Record the run in the ledger. This only queues it, the write happens on a background thread.
+    record_run(
+        gpt_payload_enhanced,
+        request['model'],
+        request['selection_criterion'],
+        time.perf_counter() - started,
+        prompts,
+        audio_provider=request.get('audio_provider'),
+        configuration_id=request.get('configuration_id'),
+    )
+
     return(gpt_payload_enhanced)
+
+def generate_until_quota(request, build_prompts, n_target, cancel_event=None, on_rows=None, max_rounds=MAX_GENERATION_ROUNDS):
+    """
+    Keeps generating until `n_target` sentences meet the selection criterion, or `max_rounds` rounds have run.
+    Accepted sentences are kept and each retry only asks for the shortfall, padded by the acceptance rate
+    seen so far so that one retry usually suffices. The words that got earlier sentences rejected are fed
+    back into the retry prompts as forbidden words.
+
+    Parameters:
+    - request (dict): As for generate_text. Its prompt(s) are used for the first round.
+    - build_prompts (callable): Called as build_prompts(n_sentences, forbidden_words) on the worker thread,
+      returning the list of prompts for a retry round. It mustn't touch any widgets.
+    - n_target (int): The number of sentences that should meet the criterion.
+    - cancel_event (threading.Event): Optional. Setting it kills the in-flight CLI call.
+    - on_rows (callable): Optional. Streams each round's rows, as for generate_text.
+    - max_rounds (int): Optional. The most generation rounds to run, including the first.
+
+    Returns:
+    - pd.DataFrame: Every distinct sentence generated across all rounds, with a 'generation_round' column.
+    """
+    scorer = request['scorer']
+    rounds = []
+    seen_sentences = set()
+    forbidden_words = Counter()
+    n_requested = n_accepted = 0
+    n_round = n_target
+    round_request = request
+
+    for generation_round in range(1, max_rounds + 1):
+        batch = generate_text(round_request, cancel_event, on_rows)
+
+        # The model sometimes repeats itself across rounds, so only keep sentences we haven't seen yet
+        batch = batch[~batch['sentence'].isin(seen_sentences)].copy()
+        batch['generation_round'] = generation_round
+        seen_sentences.update(batch['sentence'])
+        rounds.append(batch)
+
+        n_requested += n_round
+        n_accepted += int(batch['meets_criteria'].sum())
+        shortfall = n_target - n_accepted
+        if shortfall <= 0 or generation_round == max_rounds:
+            break
+
+        # Unknown words in rejected sentences, other than the new word each was meant to introduce
+        rejected = batch[~batch['meets_criteria'].astype(bool)]
+        new_words = rejected['new_word'] if 'new_word' in rejected.columns else [None] * len(rejected)
+        for unknown_words, new_word in zip(rejected['unknown_words'], new_words):
+            forbidden_words.update(word for word in unknown_words if word != new_word and word not in scorer.new_vocab)
+
+        # Over-request by the acceptance rate so far, but never ask for more than the original batch
+        acceptance_rate = max(n_accepted / n_requested, 0.25)
+        n_round = min(math.ceil(shortfall / acceptance_rate), n_target)
+        round_request = {
+            **request,
+            'prompts': build_prompts(n_round, [word for word, _ in forbidden_words.most_common(MAX_FORBIDDEN_WORDS)]),
+        }
+
+    return pd.concat(rounds, ignore_index=True)
+
+def _run_cancellable(args, input_text, cancel_event=None, poll_interval=0.2):
+    """Runs a subprocess to completion, killing it early if `cancel_event` gets set."""
+    process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    # Poll so that a cancellation is noticed within `poll_interval` seconds. The input can only be sent once.
+    pending_input = input_text
+    while True:
+        try:
+            stdout, stderr = process.communicate(input=pending_input, timeout=poll_interval)
+            return process.returncode, stdout, stderr
+        except subprocess.TimeoutExpired:
+            pending_input = None
+            if cancel_event is not None and cancel_event.is_set():
+                process.kill()
+                process.communicate()
+                raise GenerationCancelled("Generation was cancelled.")
+
+def _run_streaming(args, input_text, on_text, cancel_event=None, poll_interval=0.2):
+    """
+    Runs the Claude CLI with stream-json output, passing each piece of generated text to `on_text`
+    as it arrives. Killed early if `cancel_event` gets set.
+
+    Returns:
+    - tuple: The return code, stderr, and the final 'result' text (None if the stream never produced one).
+    """
+    process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    # Feed stdin and drain stderr on their own threads so that neither pipe can fill up and block the CLI
+    stderr_chunks = []
+    def write_input():
+        try:
+            process.stdin.write(input_text)
+            process.stdin.close()
+        except OSError:
+            pass  # The process was killed before it read its input
+    def read_errors():
+        stderr_chunks.append(process.stderr.read())
+
+    finished = threading.Event()
+    def watch_for_cancel():
+        while not finished.wait(poll_interval):
+            if cancel_event is not None and cancel_event.is_set():
+                process.kill()
+                return
+
+    helpers = [threading.Thread(target=target, daemon=True) for target in (write_input, read_errors, watch_for_cancel)]
+    for helper in helpers:
+        helper.start()
+
+    result_text = None
+    saw_deltas = False
+    try:
+        for line in process.stdout:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            # Partial messages give us the text token by token. Older CLIs only send whole assistant messages.
+            if event.get('type') == 'stream_event':
+                delta = event.get('event', {}).get('delta', {})
+                if delta.get('type') == 'text_delta':
+                    saw_deltas = True
+                    on_text(delta['text'])
+            elif event.get('type') == 'assistant' and not saw_deltas:
+                for block in event.get('message', {}).get('content', []):
+                    if block.get('type') == 'text':
+                        on_text(block['text'])
+            elif event.get('type') == 'result':
+                result_text = event.get('result')
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        finished.set()
+        process.wait()
+        for helper in helpers:
+            helper.join()
+
+    if cancel_event is not None and cancel_event.is_set():
+        raise GenerationCancelled("Generation was cancelled.")
+
+    return process.returncode, ''.join(stderr_chunks), result_text
+
+class IncrementalCsvParser:
+    """
+    Turns a CSV document arriving in arbitrary chunks of text into complete rows as soon as each one ends.
+    The first row is taken as the header, and Markdown code fences are skipped.
+    """
+    def __init__(self):
+        self.buffer = ''
+        self.header = None
+        self.in_quotes = False
+        self.scan_position = 0
+
+    def feed(self, text):
+        """Adds text and returns the rows (as dicts keyed by the header) that it completed."""
+        self.buffer += text
+        rows = []
+        record_start = 0
+        for position in range(self.scan_position, len(self.buffer)):
+            char = self.buffer[position]
+            if char == '"':
+                self.in_quotes = not self.in_quotes
+            elif char == '\n' and not self.in_quotes:
+                rows.extend(self._parse_record(self.buffer[record_start:position]))
+                record_start = position + 1
+        self.buffer = self.buffer[record_start:]
+        self.scan_position = len(self.buffer)
+        return rows
+
+    def close(self):
+        """Returns the final row, if the document didn't end with a newline."""
+        rows = self._parse_record(self.buffer)
+        self.buffer = ''
+        self.scan_position = 0
+        return rows
+
+    def _parse_record(self, record):
+        record = record.rstrip('\r')
+        if not record.strip() or record.lstrip().startswith('```'):
+            return []
+        values = next(csv.reader([record]))
+        if self.header is None:
+            self.header = values
+            return []
+        return [dict(zip(self.header, values))]
    
-# Call Claude Code CLI
-def _call_claude_cli(prompt, model_text):
+# Call Claude Code CLI. With `use_cache`, identical prompts are answered from the generation cache,
+# and `bypass_cache` forces a fresh generation (which then replaces the cached one).
+# With `on_rows`, the output is streamed and each batch of completed CSV rows is passed to it as a list of dicts.
+def _call_claude_cli(prompt, model_text, cancel_event=None, use_cache=False, bypass_cache=False, on_rows=None):
 
     # Build the full prompt by folding in the system instruction
     full_prompt = load_system_prompt() + "\n\n" + prompt
@@ -46,35 +324,112 @@ def _call_claude_cli(prompt, model_text):
     }
     model_id = model_map.get(model_text, "sonnet")
 
-    result = subprocess.run(
-        ["claude", "-p", "--model", model_id, "--output-format", "json", "--tools", ""],
-        input=full_prompt,
-        capture_output=True,
-        text=True,
-    )
+    if use_cache and not bypass_cache:
+        cached = get_cached_generation(model_id, full_prompt)
+        if cached is not None:
+            return [cached]
 
-    if result.returncode != 0:
-        raise ValueError(f"Claude CLI error: {result.stderr.strip()}")
+    if on_rows is not None:
+        parser = IncrementalCsvParser()
+        def on_text(text):
+            rows = parser.feed(text)
+            if rows:
+                on_rows(rows)
 
-    try:
-        response_json = json.loads(result.stdout)
-    except json.JSONDecodeError:
-        raise ValueError("Failed to parse Claude CLI JSON response.")
+        returncode, stderr, result_text = _run_streaming(
+            ["claude", "-p", "--model", model_id, "--output-format", "stream-json", "--verbose", "--include-partial-messages", "--tools", ""],
+            full_prompt,
+            on_text,
+            cancel_event,
+        )
 
-    generated_text = response_json["result"].strip()
+        if returncode != 0:
+            raise ValueError(f"Claude CLI error: {stderr.strip()}")
+        if result_text is None:
+            raise ValueError("The Claude CLI stream ended without a result.")
+
+        last_rows = parser.close()
+        if last_rows:
+            on_rows(last_rows)
+
+        generated_text = result_text.strip()
+
+    else:
+        returncode, stdout, stderr = _run_cancellable(
+            ["claude", "-p", "--model", model_id, "--output-format", "json", "--tools", ""],
+            full_prompt,
+            cancel_event,
+        )
+
+        if returncode != 0:
+            raise ValueError(f"Claude CLI error: {stderr.strip()}")
+
+        try:
+            response_json = json.loads(stdout)
+        except json.JSONDecodeError:
+            raise ValueError("Failed to parse Claude CLI JSON response.")
+
+        generated_text = response_json["result"].strip()
 
     # Strip markdown fences if Claude wraps the CSV despite the prompt instructions
     generated_text = _re.sub(r'^```(?:csv)?\n', '', generated_text)
     generated_text = _re.sub(r'\n```$', '', generated_text)
 
-    # Export for debugging purposes
-    with open('test-payload.csv', 'w', encoding='utf-8') as f:
-        f.write(generated_text)
+    if use_cache:
+        store_generation(model_id, full_prompt, generated_text)
 
     return [generated_text]
+
+def _call_claude_cli_sharded(prompts, model_text, cancel_event=None, max_concurrency=MAX_CONCURRENT_CLI_CALLS, **cli_options):
+    """
+    Sends each prompt to its own Claude CLI process, at most `max_concurrency` at a time,
+    and merges the CSV results in prompt order. If any shard fails the others are killed.
+    """
+    if len(prompts) == 1:
+        return _call_claude_cli(prompts[0], model_text, cancel_event, **cli_options)
+
+    cancel_event = cancel_event or threading.Event()
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(prompts))) as executor:
+        futures = [executor.submit(_call_claude_cli, prompt, model_text, cancel_event, **cli_options) for prompt in prompts]
+        wait(futures, return_when=FIRST_EXCEPTION)
+
+        # Stop the remaining shards as soon as one of them fails
+        failed = [future for future in futures if future.done() and future.exception() is not None]
+        if failed:
+            cancel_event.set()
+            errors = [future.exception() for future in failed]
+            raise next((e for e in errors if not isinstance(e, GenerationCancelled)), errors[0])
+
+        payloads = [future.result()[0] for future in futures]
+
+    return [merge_csv_payloads(payloads)]
+
+def merge_csv_payloads(payloads):
+    """
+    Concatenates several CSV texts into one, using the first header. Rows from later payloads are
+    matched to that header by column name, in case a shard came back with its columns reordered.
+    """
+    header = None
+    rows = []
+    for payload in payloads:
+        data = list(csv.reader(io.StringIO(payload)))
+        if not data:
+            continue
+        if header is None:
+            header = data[0]
+        positions = [data[0].index(column) if column in data[0] else None for column in header]
+        for row in data[1:]:
+            rows.append([row[i] if i is not None and i < len(row) else '' for i in positions])
+
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    if header is not None:
+        writer.writerow(header)
+        writer.writerows(rows)
+    return output.getvalue()
  
 # This function quality-checks the GPT payload, then it generates some diagnostics about the content of each sentence
-def evaluate_gpt_response(gpt_payload, known_vocab, new_vocab):
+def evaluate_gpt_response(gpt_payload, scorer):
     # Check whether the GPT payload matches the formatting of a .csv file: If it works then load it as a .csv. If it doesn't then throw an informative error.
     try:
         # Read the payload using the csv module to handle commas within quotes
@@ -94,34 +449,17 @@ def evaluate_gpt_response(gpt_payload, known_vocab, new_vocab):
     
     # Count the total number of sentences in the payload
     gpt_payload['n_sentences'] = len(gpt_payload)
-    
-    # Convert the vocab lists to sets, as a way of removing duplicates and enabling efficient operations
-    known_vocab_set = set(known_vocab.dropna())
-    new_vocab_set = set(new_vocab.dropna())
-    
-    # Create an inner function to call on each returned sentence one at a time
-    def count_word_types(sentence):
-
-        # Unnest the sentence into a set
-        sentence_words = set(sentence.split())
 
-        # Count various word types
-        n_words = len(sentence.split())
-        n_known_words = len(sentence_words.intersection(known_vocab_set))
+    return score_sentences(gpt_payload, scorer)
 
-        if new_vocab_set:
-            # New deck has tokens: distinguish new vs rogue
-            n_new_words = len(sentence_words.intersection(new_vocab_set))
-            n_rogue_words = len(sentence_words) - n_known_words - n_new_words
-        else:
-            # No new deck: all non-known words are "new" (Claude chose them)
-            n_new_words = len(sentence_words) - n_known_words
-            n_rogue_words = 0
+# Adds word-type counts to a table of sentences, and tidies up their HTML
+def score_sentences(gpt_payload, scorer):
 
-        return pd.Series([n_words, n_known_words, n_new_words, n_rogue_words])
-
-    # Apply the function and assign results to new columns
-    gpt_payload[['n_words', 'n_known_words', 'n_new_words', 'n_rogue_words']] = gpt_payload['sentence'].apply(count_word_types)
+    # Score the whole batch in one pass against the deck's prebuilt vocab sets
+    scores = scorer.score(gpt_payload['sentence'])
+    for column in ['n_words', 'n_known_words', 'n_new_words', 'n_rogue_words']:
+        gpt_payload[column] = scores[column]
+    gpt_payload['unknown_words'] = scores['unknown_words']
     
     # Do some adhoc correction of HTML tags, which GPT seems to predictably get wrong sometimes
     gpt_payload['sentence'] = gpt_payload['sentence'].str.replace(r'(<span class="[^"]*)&quot;([^"]*">)', r'\1"\2', regex=True)
@@ -155,49 +493,3 @@ def flag_bad_sentences(df, condition):
         df['meets_criteria'] = True
         
     return df
-
-# Function to call the other functions below
-def save_to_database(db_name, dat, gpt_model, audio_provider):
-    try:
-        # Append metadata to the database and return the run_id
-        run_id = append_run_entry(db_name, datetime.now().isoformat(), gpt_model, audio_provider)
-        if run_id is None:
-            raise Exception("Failed to append run entry.")
-
-        # Append the enhanced gpt outputs to the database
-        append_status = append_sentences(dat, run_id, db_name)
-        if not append_status:
-            raise Exception("Failed to append sentences to the database.")
-    except Exception as e:
-        print(f"Error in save_to_database: {e}")
-        raise
-
-# Append a few things to a 'metadata' table
-def append_run_entry(db_file, timestamp, gpt_model, audio_provider):
-    conn = None
-    try:
-        conn = sqlite3.connect(db_file)
-        c = conn.cursor()
-        c.execute('''INSERT INTO runs(timestamp, gpt_model, audio_provider)
-                     VALUES(?, ?, ?);''', (timestamp, gpt_model, audio_provider))
-        conn.commit()
-        run_id = c.lastrowid
-        return run_id
-    except sqlite3.Error as e:
-        print(f"Database error in append_run_entry: {e}")
-        return None
-    finally:
-        if conn:
-            conn.close()
-
-# Append the enhanced GPT response
-def append_sentences(gpt_response, run_id, db_name: str = 'database.db'):
-    try:
-        gpt_response['run_id'] = run_id
-        with sqlite3.connect(db_name) as conn:
-            gpt_response.to_sql('gpt_responses', conn, if_exists='append', index=True, index_label='sentence_order')
-        return True
-    except Exception as e:
-        print(f"Error in append_sentences: {e}")
-        return False
-        
\ No newline at end of file
@@ -0,0 +1,86 @@
+import json
+from utils.database import get_connection
+
+# Per-note vocabulary tokens and audio flags are cached alongside everything else in the app's database,
+# keyed by the note's modification time so that only edited notes are ever re-tokenized or re-fetched.
+
+# Bump whenever tokenization changes, so that previously cached tokens are recomputed
+TOKEN_CACHE_VERSION = 2
+
+# Bump whenever audio detection changes, so that previously cached audio flags are recomputed
+AUDIO_FLAG_VERSION = 2
+
+def field_signature(deck, card_type, fields, language):
+    """
+    Identifies what a cached token list was computed from. Changing the deck, card type,
+    configured fields or language of a configuration starts a fresh cache.
+    """
+    return json.dumps([TOKEN_CACHE_VERSION, deck, card_type, list(fields), language], ensure_ascii=False)
+
+def load_cached_tokens(signature):
+    """
+    Returns every cached note for a field signature.
+
+    Returns:
+    - dict: Note ID -> (modification time, list of tokens).
+    """
+    conn = get_connection()
+    rows = conn.execute("SELECT note_id, mod, tokens FROM note_tokens WHERE field_signature=?", (signature,)).fetchall()
+
+    return {note_id: (mod, json.loads(tokens)) for note_id, mod, tokens in rows}
+
+def sync_cached_tokens(signature, updated, removed_note_ids):
+    """
+    Writes freshly tokenized notes to the cache and drops notes that no longer exist, in one transaction.
+
+    Parameters:
+    - signature (str): The field signature the notes belong to.
+    - updated (dict): Note ID -> (modification time, list of tokens) for new or modified notes.
+    - removed_note_ids (iterable): Note IDs that are no longer in the deck.
+    """
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO note_tokens (field_signature, note_id, mod, tokens) VALUES (?, ?, ?, ?)",
+            [(signature, note_id, mod, json.dumps(tokens, ensure_ascii=False)) for note_id, (mod, tokens) in updated.items()]
+        )
+        conn.executemany(
+            "DELETE FROM note_tokens WHERE field_signature=? AND note_id=?",
+            [(signature, note_id) for note_id in removed_note_ids]
+        )
+
+def audio_flag_signature(deck, card_types_and_fields):
+    """Identifies which deck and configured fields a cached audio flag was computed from."""
+    return json.dumps(['audio', AUDIO_FLAG_VERSION, deck, {card_type: list(fields) for card_type, fields in card_types_and_fields.items()}], ensure_ascii=False, sort_keys=True)
+
+def load_cached_audio_flags(signature):
+    """
+    Returns every cached audio flag for a signature.
+
+    Returns:
+    - dict: Note ID -> (modification time, whether one of the configured fields has audio).
+    """
+    conn = get_connection()
+    rows = conn.execute("SELECT note_id, mod, has_audio FROM note_audio_flags WHERE field_signature=?", (signature,)).fetchall()
+
+    return {note_id: (mod, bool(has_audio)) for note_id, mod, has_audio in rows}
+
+def sync_cached_audio_flags(signature, updated, removed_note_ids):
+    """
+    Writes freshly computed audio flags to the cache and drops notes that no longer exist, in one transaction.
+
+    Parameters:
+    - signature (str): The signature the notes belong to.
+    - updated (dict): Note ID -> (modification time, has audio) for the notes that were fetched.
+    - removed_note_ids (iterable): Note IDs that are no longer in the deck.
+    """
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO note_audio_flags (field_signature, note_id, mod, has_audio) VALUES (?, ?, ?, ?)",
+            [(signature, note_id, mod, int(has_audio)) for note_id, (mod, has_audio) in updated.items()]
+        )
+        conn.executemany(
+            "DELETE FROM note_audio_flags WHERE field_signature=? AND note_id=?",
+            [(signature, note_id) for note_id in removed_note_ids]
+        )
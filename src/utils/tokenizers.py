@@ -0,0 +1,102 @@
+import re
+
+# Markup that Anki and the language model wrap around the actual words
+HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+SOUND_TAG_PATTERN = re.compile(r'\[sound:[^\]]+\]')
+CLOZE_PATTERN = re.compile(r'\{\{c\d+::([^:]+)::[^}]+\}\}')
+PUNCTUATION_PATTERN = re.compile("\u0964")
+
+def character_segmenter(chunk):
+    """Fallback segmenter that treats every character as its own token."""
+    return list(chunk)
+
+def mandarin_segmenter():
+    """Uses jieba's dictionary segmentation if it's installed, otherwise one token per character."""
+    try:
+        import jieba
+    except ImportError:
+        return character_segmenter
+    return lambda chunk: jieba.lcut(chunk, HMM=False)
+
+class Tokenizer:
+    """
+    Turns raw text in one language into vocabulary tokens: strips Anki markup, removes every
+    character that doesn't belong to the language, splits on whitespace and, for unsegmented
+    scripts, segments each chunk into words. All patterns are compiled once per language.
+    """
+    def __init__(self, language, characters, segmenter=None):
+        self.language = language
+        self.segmenter = segmenter
+        self.non_language_pattern = re.compile(f"[^{characters} \n]")
+
+        # A single pass that removes HTML tags, sound tags, punctuation and non-language characters together.
+        # The alternation tries the tag patterns first at each position, so it behaves like applying them one after another.
+        self.cleanup_pattern = re.compile(
+            f"{HTML_TAG_PATTERN.pattern}|{SOUND_TAG_PATTERN.pattern}|{PUNCTUATION_PATTERN.pattern}|{self.non_language_pattern.pattern}"
+        )
+
+    def remove_non_language(self, text):
+        return self.non_language_pattern.sub('', text)
+
+    def clean(self, text):
+        # Unwrap Cloze deletions first, since the cleanup pass removes the braces and colons they're matched on
+        return self.cleanup_pattern.sub('', CLOZE_PATTERN.sub(r'\1', text))
+
+    def tokenize(self, text):
+        """Returns the tokens of a single string, in order."""
+        chunks = self.clean(str(text)).split()
+        if self.segmenter is None:
+            return chunks
+        return [token for chunk in chunks for token in self.segmenter(chunk)]
+
+    def tokenize_series(self, texts):
+        """
+        Tokenizes a whole series of strings in one vectorized stage.
+
+        Returns:
+        - pd.Series: One row per token, indexed by the index of the text it came from.
+        """
+        cleaned = (texts.astype(str)
+                   .str.replace(CLOZE_PATTERN, r'\1', regex=True)
+                   .str.replace(self.cleanup_pattern, '', regex=True))
+
+        # Explode the split lists into a long series rather than expanding into one column per word
+        tokens = cleaned.str.split().explode().dropna()
+        if self.segmenter is not None and len(tokens):
+            tokens = tokens.map(self.segmenter).explode().dropna()
+        return tokens
+
+_TOKENIZER_FACTORIES = {}
+_TOKENIZERS = {}
+
+def register_tokenizer(language, characters, segmenter_factory=None):
+    """
+    Registers a language with the tokenizer registry.
+
+    Parameters:
+    - language (str): The configuration_language the tokenizer is used for.
+    - characters (str): The characters of the language, as the body of a regex character class.
+    - segmenter_factory (callable): Optional. Returns a callable splitting an unspaced chunk into words.
+      It's only called the first time the tokenizer is needed, so segmenters can load dictionaries lazily.
+    """
+    _TOKENIZER_FACTORIES[language] = lambda: Tokenizer(
+        language, characters, segmenter_factory() if segmenter_factory else None
+    )
+    _TOKENIZERS.pop(language, None)
+
+def get_tokenizer(language):
+    """Returns the shared Tokenizer for a language, building it on first use."""
+    if language not in _TOKENIZERS:
+        if language not in _TOKENIZER_FACTORIES:
+            raise ValueError("Unsupported language")
+        _TOKENIZERS[language] = _TOKENIZER_FACTORIES[language]()
+    return _TOKENIZERS[language]
+
+def supported_languages():
+    return sorted(_TOKENIZER_FACTORIES)
+
+register_tokenizer('Hindi', "\u0900-\u097F")
+register_tokenizer('Arabic', "\u0600-\u06FF")
+register_tokenizer('Mandarin', "\u4e00-\u9fff", segmenter_factory=mandarin_segmenter)
+register_tokenizer('French', "a-zA-ZÀ-ÿœŒ")
+register_tokenizer('Turkish', "a-zA-ZÀ-ÿğĞıİşŞçÇöÖüÜ")
@@ -1,13 +1,11 @@
-from PyQt5.QtWidgets import QMessageBox, QLabel, QHBoxLayout, QLineEdit, QCheckBox, QTreeWidgetItem
+from PyQt5.QtWidgets import QMessageBox, QLabel, QHBoxLayout, QLineEdit, QCheckBox
 from PyQt5.QtCore import pyqtSignal, QRegExp
 from PyQt5.QtGui import QRegExpValidator
-import pandas as pd
 from generating_frame import GeneratingFrameQt
 import sys
 import random
 sys.path.append("../utils/")
-from utils.text_generating_functions import generate_text
-from utils.audio_generating_functions import generate_audio
+from utils.text_generating_functions import generate_text, select_prompt_vocab
 from utils.anki_connect_functions import *
 from utils.prompt_loader import load_prompt
 
@@ -43,6 +41,11 @@ def add_tense_emojis(sentence, conjugation):
 
 class VerbExploderFrameQt(GeneratingFrameQt):
     update_ui_signal = pyqtSignal(object)
+    table_columns = [
+        ('sentence', 'Sentence'), ('translation', 'Translation'), ('target_verb', 'Target Verb'),
+        ('conjugation', 'Conjugation'), ('n_words', 'Total Words'), ('n_known_words', 'Known Words'),
+        ('n_new_words', 'New Words'), ('n_rogue_words', 'Rogue Words'),
+    ]
     
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -105,18 +108,14 @@ class VerbExploderFrameQt(GeneratingFrameQt):
             QMessageBox.warning(self, "Input Required", "You forgot to input a verb.")
             return  
         
-        self.generate_button.setEnabled(False)
-       # self.animation.start()
-        
         # Build vocab instruction if checkbox is checked
         vocab_instruction = ""
+        n_prompt_vocab = 0
         if self.vocab_checkbox.isChecked():
-            VOCAB_SAMPLE_SIZE = 150
-            learned = self.controller.learned_deck_tokens
-            if len(learned) > VOCAB_SAMPLE_SIZE:
-                sampled = learned.sample(n=VOCAB_SAMPLE_SIZE, replace=False)
-            else:
-                sampled = learned
+            # The most frequent learned words, rather than a random sample, so prompts stay stable between runs
+            VOCAB_BUDGET = 150
+            sampled = select_prompt_vocab(self.controller.learned_deck_tokens, VOCAB_BUDGET)
+            n_prompt_vocab = len(sampled)
             vocab_instruction = (
                 "The student already knows the following vocabulary words:\n"
                 f"{', '.join(sampled)}\n\n"
@@ -134,27 +133,19 @@ class VerbExploderFrameQt(GeneratingFrameQt):
             verb_input=self.verb_input.text(),
             vocab_instruction=vocab_instruction,
         )
+        self.show_prompt_size([self.prompt], n_prompt_vocab)
         
-        try:
-
-            # Check whether the 'verb exploder' card type exists.
-            has_ve = check_for_ve_card_type()
-
-            # If the 'verb exploder' card type doesn't exist then create it
-            if not has_ve:
-                create_ve_card_type()
-
-            # Generate sentences with the necessary cloze formatting and HTML tag around the target verb
-            generated_sentences = generate_text(self)
+        # Check whether the 'verb exploder' card type exists.
+        has_ve = check_for_ve_card_type()
 
-            # Update the UI after generation
-            self.update_ui_after_generation(generated_sentences, 'meets_criteria')
+        # If the 'verb exploder' card type doesn't exist then create it
+        if not has_ve:
+            create_ve_card_type()
 
-        except ValueError as e:  # Catch the specific error raised in generate_text
-            QMessageBox.critical(self, "Generation Error", str(e))
-            generated_sentences = None  # Or handle this case as needed
-
-        self.generate_button.setEnabled(True)
+        # Generate sentences with the necessary cloze formatting and HTML tag around the target verb,
+        # on a worker thread; the results come back through update_ui_signal
+        request = self.generation_request()
+        self.start_generation(lambda cancel_event, on_rows: generate_text(request, cancel_event, on_rows))
         
     def update_ui_after_generation(self, sentences, checkbox_column):
 
@@ -165,81 +156,29 @@ class VerbExploderFrameQt(GeneratingFrameQt):
         self.export_button.show()
         self.audio_frame.show()
         
-    # Override interited method
-    def populate_treeview(self, data_frame):
-        self.table.clear()
-        self.table.setColumnCount(9)  # Assuming 9 columns including the checkbox column
-        self.table.setHeaderLabels([
-            'Export', 'Sentence', 'Translation', 'Target Verb',  
-            'Conjugation', 'Total Words', 'Known Words', 'New Words',
-            'Rogue Words'
-        ])
-
-        for row in data_frame.itertuples():
-            tree_item = QTreeWidgetItem(self.table)
-
-            # Checkbox in the first column
-            checkbox = QCheckBox()
-            checkbox.setChecked(row.meets_criteria)
-            self.table.setItemWidget(tree_item, 0, checkbox)
-
-            # Set other columns
-            tree_item.setText(1, str(row.sentence))
-            tree_item.setText(2, str(row.translation))
-            tree_item.setText(3, str(row.target_verb))
-            tree_item.setText(4, str(row.conjugation))
-            tree_item.setText(5, str(row.n_words))
-            tree_item.setText(6, str(row.n_known_words))
-            tree_item.setText(7, str(row.n_new_words))
-            tree_item.setText(8, str(row.n_rogue_words))
-            
     def export_to_anki(self):
-        from decks_homepage import DecksHomepageQt
         
-        # Create a list to hold data for rows where the 'Export' checkbox is checked
-        export_data = []
-
-        # Iterate through the tree view items
-        for index in range(self.table.topLevelItemCount()):
-            item = self.table.topLevelItem(index)
-            # Check if the checkbox in the 'Export' column is checked
-            if self.table.itemWidget(item, 0).isChecked():
-                # Append the data of the row to the export_data list
-                export_data.append({
-                    'sentence': item.text(1),
-                    'translation': item.text(2),
-                    'target_verb': item.text(3),
-                    'conjugation': item.text(4),
-                    'total_words': item.text(5),
-                    'known_words': item.text(6),
-                    'new_words': item.text(7),
-                    'rogue_words': item.text(8),
-                })
+        # Rows where the 'Export' checkbox is checked, read straight from the table model
+        export_df = self.table_model.checked_rows()
                 
-        if not export_data:
+        if export_df.empty:
             QMessageBox.warning(self, "Export Error", "Please check at least one item to export.")
             return  # Stop the function execution
 
-        # Create a DataFrame from the collected data
-        export_df = pd.DataFrame(export_data)
-        
         # Add tense/polarity emojis to sentences based on conjugation labels (Turkish only)
         if self.controller.selected_language == "Turkish":
             export_df['sentence'] = export_df.apply(
                 lambda row: add_tense_emojis(row['sentence'], row['conjugation']), axis=1
             )
 
-        # If the 'audio' checkbox is checked then generate the audio files and pack them into Anki's media folder
-        if self.audio_checkbox.isChecked():
-            export_df = generate_audio(export_df, self.controller.selected_language, self.controller.selected_profile_name, self.audio_source_picklist.currentText())
-    
-        else: export_df['audio'] = ' '
-        
-        # Create the cards in Anki
-        result = export_df.apply(lambda row: create_new_card(
-            deck_name=self.controller.learned_deck,
-            gpt_model=self.model_picklist.currentText(),
-            audio_provider=self.audio_source_picklist.currentText(),
+        # Create the cards in Anki, each one as soon as its audio is ready
+        deck_name = self.controller.learned_deck
+        gpt_model = self.model_picklist.currentText()
+        audio_provider = self.audio_source_picklist.currentText()
+        self.start_export(export_df, lambda row: build_note(
+            deck_name=deck_name,
+            gpt_model=gpt_model,
+            audio_provider=audio_provider,
             anki_model="Spoonfed Verb Exploder",
             functionality="verb-exploder",
             fields={
@@ -247,13 +186,5 @@ class VerbExploderFrameQt(GeneratingFrameQt):
                 'Translation': row['translation'], 
                 'Audio': row['audio']
             }
-        ), axis=1)
-
-        if result.eq("success").all():
-            QMessageBox.information(self, "Success", "Cards successfully created in Anki.")
-        else:
-            QMessageBox.warning(self, "Export Error", "Cards could not be created.")
-            
-        # Return to the decks homepage        
-        self.controller.show_frame(DecksHomepageQt)
+        ))
         
\ No newline at end of file